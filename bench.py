@@ -0,0 +1,171 @@
+import argparse
+import os, sys
+import json
+import time
+import struct
+import shutil
+import tempfile
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+
+from threads.kline import KlineWorker
+from simulator import SimulatedKlineAdapter, SIM_TABLES
+from profiles import ECUProfiles
+from polling import TableScheduler
+from instrument import CommandStats
+
+BENCHMARKS = ["read", "write", "datalog", "log"]
+
+class BenchParent(object):
+
+	def __init__(self):
+		self.run = True
+		self.active_ftdi_device = None
+
+class BenchRun(object):
+
+	def __init__(self, args, tmpdir):
+		self.args = args
+		self.tmpdir = tmpdir
+		self.sim = SimulatedKlineAdapter(args.bin, baudrate=args.baudrate, latency=args.latency/1000.0, error_rate=args.error_rate, seed=0)
+		if args.size:
+			del self.sim.ecu.image[args.size:]
+		self.worker = KlineWorker(BenchParent(), "bench", adapter=lambda device_id: self.sim)
+		self.worker.profiles = ECUProfiles(os.path.join(tmpdir, "profiles.json"))
+		self.worker.stats = CommandStats(samples=True)
+		self.worker.activate()
+
+	def measure(self, fn):
+		c = time.process_time()
+		t = time.perf_counter()
+		count = fn()
+		elapsed = time.perf_counter() - t
+		cpu = time.process_time() - c
+		lat = np.array(self.worker.stats.samples)
+		result = {
+			"count": count,
+			"elapsed": elapsed,
+			"rate": count / elapsed if elapsed > 0 else 0,
+			"cpu": cpu / elapsed * 100.0 if elapsed > 0 else 0,
+			"transactions": len(lat),
+			"failed": self.failed,
+		}
+		if len(lat) > 0:
+			for p in [50, 90, 99]:
+				result["p%d" % p] = float(np.percentile(lat, p))
+			result["max"] = float(lat.max())
+		return result
+
+	def bench_read(self):
+		self.sim.ecu.state = "read"
+		binfile = os.path.join(self.tmpdir, "read.bin")
+		self.worker.readinfo = [binfile, 0, None, None]
+		self.worker.read_flash()
+		with open(binfile, "rb") as f:
+			byts = f.read()
+		self.failed = byts != bytes(self.sim.ecu.image)
+		return len(byts)
+
+	def bench_write(self):
+		self.sim.ecu.state = "write"
+		byts = bytes(self.sim.ecu.image)
+		self.sim.ecu.image[:] = b"\xff" * len(byts)
+		self.worker.writeinfo = [byts, 0, None, False]
+		self.failed = self.worker.write_flash(byts) != 0
+		self.failed = self.failed or bytes(self.sim.ecu.image) != byts
+		return len(byts)
+
+	def bench_datalog(self):
+		self.worker.tables = dict((t, [0, b""]) for t in SIM_TABLES)
+		self.worker.scheduler = TableScheduler(self.worker.tables.keys())
+		self.worker.update_tables = True
+		t = time.time()
+		while time.time() - t < self.args.duration:
+			self.worker.do_update_tables()
+		samples = sum([e["count"] for e in self.worker.scheduler.entries.values()])
+		self.failed = samples == 0
+		return samples
+
+	def bench_log(self):
+		u = ">H12BHBBH"
+		samples = 0
+		t = time.time()
+		while time.time() - t < self.args.duration:
+			info = self.worker.ecu.send_command([0x72], [0x71, 0x11])
+			if info and len(info[2][2:]) > 0:
+				struct.unpack(u, info[2][2:])
+				samples += 1
+		self.failed = samples == 0
+		return samples
+
+	def run(self, name):
+		self.failed = False
+		return self.measure(getattr(self, "bench_%s" % name))
+
+def version(label):
+	if label:
+		return label
+	try:
+		from version import __VERSION__
+		return __VERSION__
+	except Exception:
+		return "unknown"
+
+def load_results(path):
+	try:
+		with open(path, "r") as f:
+			return json.load(f)
+	except (IOError, ValueError):
+		return {"runs": []}
+
+def previous(results, name, config):
+	for run in reversed(results["runs"]):
+		if run["config"] == config and name in run["results"]:
+			return run["version"], run["results"][name]
+	return None, None
+
+def Main():
+	parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+	parser.add_argument('--bin', default=os.path.join("bins", "CB650F_MFN_2014-2018", "38770-MJE-D41.bin"), help="image backing the simulated ecu")
+	parser.add_argument('--size', type=lambda x: int(x, 0), default=0x4000, help="bytes of the image to read/write (0 for all)")
+	parser.add_argument('--duration', type=float, default=5.0, help="seconds per datalog/log benchmark")
+	parser.add_argument('--baudrate', type=int, default=10400, help="simulated k-line baudrate (0 for no wire delay)")
+	parser.add_argument('--latency', type=float, default=5.0, help="simulated ecu reply latency (ms)")
+	parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of dropped ecu replies")
+	parser.add_argument('--results', default="bench_results.json", help="results history file")
+	parser.add_argument('--label', default=None, help="version label for this run (default: git describe)")
+	parser.add_argument('--nosave', action='store_true', help="don't store results")
+	parser.add_argument('benchmarks', nargs='*', default=BENCHMARKS, help="benchmarks to run (%s)" % ", ".join(BENCHMARKS))
+	args = parser.parse_args()
+
+	config = {"bin":os.path.basename(args.bin), "size":args.size, "duration":args.duration, "baudrate":args.baudrate, "latency":args.latency, "error_rate":args.error_rate}
+	results = load_results(args.results)
+	run = {"version":version(args.label), "time":time.time(), "config":config, "results":{}}
+	ret = 0
+	for name in args.benchmarks:
+		if name not in BENCHMARKS:
+			parser.error("unknown benchmark: %s" % name)
+		tmpdir = tempfile.mkdtemp()
+		try:
+			r = BenchRun(args, tmpdir).run(name)
+		finally:
+			shutil.rmtree(tmpdir, ignore_errors=True)
+		run["results"][name] = r
+		unit = "B/s" if name in ["read", "write"] else "samples/s"
+		line = "%-8s %10.2f %-9s p50 %7.2fms p90 %7.2fms p99 %7.2fms cpu %5.1f%%" % (name, r["rate"], unit, r.get("p50", 0), r.get("p90", 0), r.get("p99", 0), r["cpu"])
+		pv, pr = previous(results, name, config)
+		if pr and pr["rate"] > 0:
+			line += "  %+.1f%% vs %s" % ((r["rate"] / pr["rate"] - 1) * 100.0, pv)
+		if r["failed"]:
+			line += "  FAILED"
+			ret = 1
+		print(line)
+	if not args.nosave:
+		results["runs"].append(run)
+		with open(args.results, "w") as f:
+			json.dump(results, f, indent=1, sort_keys=True)
+	return ret
+
+if __name__ == '__main__':
+	sys.exit(Main())
@@ -0,0 +1,209 @@
+import argparse
+import os, sys
+import json
+import time
+from threading import Event, Lock, Thread
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+
+from pydispatch import dispatcher
+from pylibftdi import Driver
+
+from threads.kline import KlineWorkerPool
+from transfer import DEFAULT_PASSWORD, load_bin, load_htf
+from instrument import export_stats
+from simulator import SimulatedKlineAdapter
+
+class BatchRunner(object):
+
+	def __init__(self, output, simulate=None):
+		self.run = True
+		self.active_ftdi_device = None
+		self.output = output
+		self.lock = Lock()
+		self.done = {}
+		self.results = {}
+		if simulate:
+			self.pool = KlineWorkerPool(self, adapter=lambda device_id: SimulatedKlineAdapter(simulate, device_id=device_id))
+		else:
+			self.pool = KlineWorkerPool(self)
+		dispatcher.connect(self.KlineWorkerHandler, signal="KlineWorker", sender=dispatcher.Any)
+
+	def emit(self, **kw):
+		kw["time"] = time.time()
+		with self.lock:
+			self.output.write("%s\n" % json.dumps(kw, default=lambda x: x.hex() if isinstance(x, (bytes, bytearray)) else str(x)))
+			self.output.flush()
+
+	def KlineWorkerHandler(self, info, value, serial=None):
+		self.emit(serial=serial, event=info, value=value)
+		if info in ["read.done", "write.done"] and serial in self.done:
+			self.results[serial] = value
+			self.done[serial].set()
+
+	def submit(self, job):
+		serial = job["serial"]
+		self.done[serial] = Event()
+		self.pool.add(serial)
+		worker = self.pool.get(serial)
+		action = job["action"]
+		if action == "read":
+			worker.read(job["file"], job.get("offset", 0), job.get("password", DEFAULT_PASSWORD))
+		elif action == "erase":
+			worker.erase()
+		else:
+			worker.write(job["byts"], job.get("offset", 0), job.get("skipblank", False))
+
+	def wait(self, job, timeout):
+		ok = self.done[job["serial"]].wait(timeout)
+		result = self.results.get(job["serial"], None)
+		if not ok:
+			result = "timeout"
+		self.emit(serial=job["serial"], event="job.done", value=result)
+		return result in ["good", "ok", "erased"]
+
+	def execute(self, jobs, timeout):
+		status = {}
+		def waiter(job):
+			status[job["serial"]] = self.wait(job, timeout)
+		for job in jobs:
+			self.submit(job)
+		threads = [Thread(target=waiter, args=(job,), daemon=True) for job in jobs]
+		for t in threads:
+			t.start()
+		# short joins keep the main thread responsive to ctrl-c
+		for t in threads:
+			while t.is_alive():
+				t.join(.2)
+		self.run = False
+		self.pool.join()
+		return all(status.values())
+
+def list_devices():
+	devices = []
+	for device in Driver().list_devices():
+		vendor, product, serial = map(lambda x: x.decode('latin1'), device)
+		devices.append({"vendor":vendor, "product":product, "serial":serial})
+	return devices
+
+def load_image(path, checksum):
+	offset = 0
+	if os.path.splitext(path)[1].lower() == ".htf":
+		status, byts, htfoffset = load_htf(path)
+		if htfoffset != None:
+			offset = int(htfoffset, 16)
+	else:
+		status, byts = load_bin(path, checksum)
+	if status == "bad":
+		return None, None
+	return byts, offset
+
+def make_job(action, serial, path, offset=0, checksum=-1, skipblank=False):
+	job = {"action":action, "serial":serial, "offset":offset}
+	if action == "read":
+		job["file"] = path
+	elif action == "write":
+		byts, htfoffset = load_image(path, checksum)
+		if byts is None:
+			return None
+		job["byts"] = byts
+		job["skipblank"] = skipblank
+		if htfoffset:
+			job["offset"] = htfoffset
+	return job
+
+def parse_int(x):
+	if isinstance(x, int):
+		return x
+	return int(x, 0)
+
+def batch_jobs(args):
+	jobs = []
+	if args.jobs:
+		with open(args.jobs, "r") as fjobs:
+			for j in json.load(fjobs):
+				jobs.append((j.get("action", "write"), j["serial"], j.get("file", None), parse_int(j.get("offset", 0)), parse_int(j.get("checksum", -1)), j.get("skipblank", args.skipblank)))
+	else:
+		for f in sorted(os.listdir(args.dir)):
+			serial, ext = os.path.splitext(f)
+			if ext.lower() in [".bin", ".htf"]:
+				jobs.append(("write", serial, os.path.join(args.dir, f), 0, int(args.checksum, 0), args.skipblank))
+	return jobs
+
+def Main():
+	parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+	parser.add_argument('--timeout', type=float, default=600, help="seconds to wait for each job")
+	parser.add_argument('--output', default=None, help="progress output file (json lines)")
+	parser.add_argument('--stats', default=None, help="export per-command latency statistics to this json file")
+	parser.add_argument('--simulate', default=None, help="use a simulated ecu backed by this bin instead of ftdi adapters")
+	sub = parser.add_subparsers(dest="command")
+	sub.required = True
+	sub.add_parser('list', formatter_class=argparse.ArgumentDefaultsHelpFormatter, help="list connected adapters")
+	p = sub.add_parser('validate', formatter_class=argparse.ArgumentDefaultsHelpFormatter, help="validate an image")
+	p.add_argument('file', help="bin or htf image")
+	p.add_argument('--checksum', default="-1", help="checksum location (bin only)")
+	p = sub.add_parser('read', formatter_class=argparse.ArgumentDefaultsHelpFormatter, help="read ecu flash to file")
+	p.add_argument('serial', help="adapter serial")
+	p.add_argument('file', help="output bin")
+	p.add_argument('--offset', default="0x0", help="start offset (decimal or 0x hex)")
+	p = sub.add_parser('write', formatter_class=argparse.ArgumentDefaultsHelpFormatter, help="write image to ecu")
+	p.add_argument('serial', help="adapter serial")
+	p.add_argument('file', help="bin or htf image")
+	p.add_argument('--offset', default="0x0", help="start offset (decimal or 0x hex)")
+	p.add_argument('--checksum', default="-1", help="checksum location (bin only)")
+	p.add_argument('--skipblank', action="store_true", help="skip erased (all 0xFF) blocks")
+	p = sub.add_parser('erase', formatter_class=argparse.ArgumentDefaultsHelpFormatter, help="erase ecu flash")
+	p.add_argument('serial', help="adapter serial")
+	p = sub.add_parser('batch', formatter_class=argparse.ArgumentDefaultsHelpFormatter, help="write images to several ecus in parallel")
+	g = p.add_mutually_exclusive_group(required=True)
+	g.add_argument('--dir', help="directory of <serial>.bin/<serial>.htf images")
+	g.add_argument('--jobs', help="json list of {action, serial, file, offset, checksum, skipblank}")
+	p.add_argument('--checksum', default="-1", help="checksum location (bin only)")
+	p.add_argument('--skipblank', action="store_true", help="skip erased (all 0xFF) blocks")
+	args = parser.parse_args()
+
+	if args.output == None:
+		args.output = sys.stdout
+	else:
+		args.output = open(args.output,"w")
+
+	if args.command == "list":
+		for d in list_devices():
+			args.output.write("%s\n" % json.dumps(d))
+		return 0
+	elif args.command == "validate":
+		byts, offset = load_image(args.file, int(args.checksum, 0))
+		args.output.write("%s\n" % json.dumps({"file":args.file, "status":"bad" if byts is None else "good", "size":len(byts) if byts else 0, "offset":offset}))
+		return 0 if byts is not None else 1
+	elif args.command == "batch":
+		specs = batch_jobs(args)
+	elif args.command == "read":
+		specs = [("read", args.serial, os.path.abspath(args.file), parse_int(args.offset), -1, False)]
+	elif args.command == "write":
+		specs = [("write", args.serial, args.file, parse_int(args.offset), int(args.checksum, 0), args.skipblank)]
+	else:
+		specs = [("erase", args.serial, None, 0, -1, False)]
+
+	runner = BatchRunner(args.output, simulate=args.simulate)
+	jobs = []
+	for s in specs:
+		job = make_job(*s)
+		if job is None:
+			runner.emit(serial=s[1], event="job.done", value="bad image: %s" % s[2])
+			return 1
+		jobs.append(job)
+	if len(set(j["serial"] for j in jobs)) != len(jobs):
+		runner.emit(serial=None, event="job.done", value="duplicate serial in batch")
+		return 1
+	try:
+		ok = runner.execute(jobs, args.timeout)
+	except KeyboardInterrupt:
+		runner.run = False
+		runner.pool.join()
+		ok = False
+	if args.stats:
+		export_stats(args.stats, dict((serial, w.stats) for serial, w in runner.pool.workers.items()))
+	return 0 if ok else 1
+
+if __name__ == '__main__':
+	sys.exit(Main())
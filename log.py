@@ -4,73 +4,102 @@ import platform
 from eculib import *
 from pylibftdi import FtdiError
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+
+import numpy as np
+from datalog import DatalogWriter, DatalogReader
+from tables import MAIN_TABLES, get_layout
+
+def Decode(args):
+	reader = DatalogReader(args.decode)
+	tables = reader.tables()
+	table = None
+	for t in MAIN_TABLES:
+		if t in tables:
+			table = t
+			break
+	if table is None:
+		return
+	layout = get_layout(table)
+	times, data = reader.arrays(table)
+	values = layout.decode_many(data)
+	if args.output.endswith(".npz"):
+		columns = dict((layout.names[i], values[:, i]) for i in layout.visible)
+		np.savez(args.output, time=times, data=data, table=table, start=reader.starttime, **columns)
+		return
+	with open(args.output, "w") as f:
+		f.write("%s\n" % "\t".join(["time"] + [layout.names[i] for i in layout.visible]))
+		for t, row in zip(times, values[:, layout.visible]):
+			f.write("%f\t%s\n" % (t, "\t".join(map(str, row))))
+
 def Main():
 	parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
 	parser.add_argument('--output', default=None, help="log output file")
+	parser.add_argument('--format', default="text", choices=["text","binary"], help="log output format")
+	parser.add_argument('--decode', default=None, help="decode a binary log to --output (csv, or numpy arrays if it ends in .npz)")
+	parser.add_argument('--simulate', default=None, help="use a simulated ecu backed by this bin instead of an ftdi adapter")
 	args = parser.parse_args()
 
-	if args.output == None:
+	if args.decode:
+		if args.output == None:
+			parser.error("--decode needs --output")
+		Decode(args)
+		return
+
+	writer = None
+	if args.format == "binary":
+		if args.output == None:
+			parser.error("binary logs need --output")
+	elif args.output == None:
 		args.output = sys.stdout
 	else:
 		args.output = open(args.output,"w")
 
-	skip_header = False
 	table = None
 	start = None
-	ecu = HondaECU(KlineAdapter(device_id=None))
-	hl = 0
-	while True:
-		state = ecu.detect_ecu_state()
-		if state == ECUSTATE.OK:
-			if hl is 0:
-				header = [
-					"time","engine_speed",
-					"tps_sensor_voltage","tps_sensor_scantool",
-					"ect_sensor_voltage","ect_sensor_scantool",
-					"iat_sensor_voltage","iat_sensor_scantool",
-					"map_sensor_voltage","map_sensor_scantool",
-					"battery_voltage","vehicle_speed",
-					"injector_duration","ignition_advance"
-				]
-				u = ">H12BHB"
-				h = header
-				hl = len(h) - 1
-				for t in [0x10,0x11,0x17]:
-					info = ecu.send_command([0x72], [0x71, t])
+	if args.simulate:
+		from simulator import SimulatedKlineAdapter
+		ecu = HondaECU(SimulatedKlineAdapter(args.simulate))
+	else:
+		ecu = HondaECU(KlineAdapter(device_id=None))
+	try:
+		while True:
+			state = ecu.detect_ecu_state()
+			if state == ECUSTATE.OK:
+				if table is None:
+					for t in MAIN_TABLES:
+						info = ecu.send_command([0x72], [0x71, t])
+						if info and len(info[2][2:]) > 0:
+							table = t
+							break
+					if table is None:
+						continue
+					if args.format == "binary":
+						ecmid = ecu.send_command([0x72], [0x71, 0x00])
+						writer = DatalogWriter(args.output, ecmid[2][2:7] if ecmid else b"")
+					else:
+						layout = get_layout(table)
+						args.output.write("%s\n" % "\t".join(["time"] + [layout.names[i] for i in layout.visible]))
+						start = time.time()
+				while True:
+					info = ecu.send_command([0x72], [0x71, table])
 					if info and len(info[2][2:]) > 0:
-						table = t
+						if writer:
+							writer.append(table, info[2][2:])
+						else:
+							now = time.time() - start
+							data = layout.decode(info[2][2:])
+							args.output.write("%f\t%s\n" % (now,"\t".join([str(data[i]) for i in layout.visible])))
+					else:
 						break
-				if t == 0x11:
-					u += "BH"
-					h += ["iacv_pulse_count","iacv_command"]
-					hl += 2
-				elif t == 0x17:
-					u += "BB"
-				args.output.write("%s\n" % "\t".join(h))
-				start = time.time()
-			while True:
-				info = ecu.send_command([0x72], [0x71, table])
-				now = time.time() - start
-				if info and len(info[2][2:]) > 0:
-					data = list(struct.unpack(u, info[2][2:]))
-					data[1] = data[1]/0xff*5.0
-					data[2] = data[2]/1.6
-					data[3] = data[3]/0xff*5.0
-					data[4] = -40 + data[4]
-					data[5] = data[5]/0xff*5.0
-					data[6] = -40 + data[6]
-					data[7] = data[7]/0xff*5.0
-					data[11] = data[11]/10
-					data[13] = data[13]/0xffff*265.5
-					data[14] = -64 + data[14]/0xff*127.5
-					if table == 0x11:
-						data[16] = data[16]/0xffff*8.0
-					args.output.write("%f\t%s\n" % (now,"\t".join(map(str,data[:9]+data[11:(hl+2)]))))
-				else:
-					break
-		else:
-			ecu.init()
-			ecu.ping(mode=0xff)
+			else:
+				ecu.init()
+				ecu.ping(mode=0xff)
+	except KeyboardInterrupt:
+		pass
+	finally:
+		if writer:
+			writer.close()
 
 if __name__ == '__main__':
 	Main()
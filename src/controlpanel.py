@@ -17,7 +17,8 @@ from frames.hrcsettings import HondaECU_HRCDataSettingsPanel
 from frames.tune import TunePanel
 from frames.tunehelper import HondaECU_TunePanelHelper
 
-from threads.kline import KlineWorker
+from threads.kline import KlineWorkerPool
+from instrument import export_stats
 from threads.usb import USBMonitor
 
 import tarfile
@@ -80,6 +81,9 @@ class HondaECU_LogPanel(wx.Frame):
 		saveItem = wx.MenuItem(fileMenu, wx.ID_SAVEAS, '&Save As\tCtrl+S')
 		self.Bind(wx.EVT_MENU, self.OnSave, saveItem)
 		fileMenu.Append(saveItem)
+		exportItem = wx.MenuItem(fileMenu, wx.ID_ANY, 'Export command statistics')
+		self.Bind(wx.EVT_MENU, self.OnExportStats, exportItem)
+		fileMenu.Append(exportItem)
 		fileMenu.AppendSeparator()
 		quitItem = wx.MenuItem(fileMenu, wx.ID_EXIT, '&Quit\tCtrl+Q')
 		self.Bind(wx.EVT_MENU, self.OnClose, quitItem)
@@ -88,6 +92,9 @@ class HondaECU_LogPanel(wx.Frame):
 		self.menubar.Append(viewMenu, '&View')
 		self.autoscrollItem = viewMenu.AppendCheckItem(wx.ID_ANY, 'Auto scroll log')
 		self.autoscrollItem.Check()
+		statsItem = wx.MenuItem(viewMenu, wx.ID_ANY, 'Command statistics\tCtrl+T')
+		self.Bind(wx.EVT_MENU, self.OnStats, statsItem)
+		viewMenu.Append(statsItem)
 		self.logText = wx.TextCtrl(self, style = wx.TE_MULTILINE|wx.TE_READONLY|wx.HSCROLL)
 		sizer = wx.BoxSizer(wx.VERTICAL)
 		sizer.Add(self.logText, 1, wx.EXPAND|wx.ALL, 5)
@@ -110,6 +117,20 @@ class HondaECU_LogPanel(wx.Frame):
 			except IOError:
 				print("Cannot save current data in file '%s'." % pathname)
 
+	def OnStats(self, event):
+		for serial, worker in self.GetParent().klineworkers.workers.items():
+			self.ECUDebugHandler("command statistics for %s:\n%s" % (serial, "\n".join(worker.stats.summary())))
+
+	def OnExportStats(self, event):
+		with wx.FileDialog(self, "Export command statistics", wildcard="JSON files (*.json)|*.json", style=wx.FD_SAVE | wx.FD_OVERWRITE_PROMPT) as fileDialog:
+			if fileDialog.ShowModal() == wx.ID_CANCEL:
+				return
+			pathname = fileDialog.GetPath()
+			try:
+				export_stats(pathname, dict((serial, worker.stats) for serial, worker in self.GetParent().klineworkers.workers.items()))
+			except IOError:
+				print("Cannot save command statistics in file '%s'." % pathname)
+
 	def OnClose(self, event):
 		self.Hide()
 
@@ -129,7 +150,8 @@ class HondaECU_ControlPanel(wx.Frame):
 		self.run = True
 		self.active_ftdi_device = None
 		self.ftdi_devices = {}
-		self.__clear_data()
+		self.ecuinfos = {}
+		self.ecuinfo = {}
 
 		if getattr(sys, 'frozen', False):
 			self.basepath = sys._MEIPASS
@@ -145,6 +167,7 @@ class HondaECU_ControlPanel(wx.Frame):
 				"icon":"images/chip2.png",
 				"conflicts":["data","hrc"],
 				"panel":HondaECU_FlashPanel,
+				"perdevice":True,
 				"disabled":True,
 				"enable": [ECUSTATE.OK, ECUSTATE.RECOVER_OLD, ECUSTATE.RECOVER_NEW, ECUSTATE.WRITEx00, ECUSTATE.WRITEx30, ECUSTATE.READ],
 			},
@@ -255,7 +278,7 @@ class HondaECU_ControlPanel(wx.Frame):
 		dispatcher.connect(self.TunePanelHelperHandler, signal="TunePanelHelper", sender=dispatcher.Any)
 
 		self.usbmonitor = USBMonitor(self)
-		self.klineworker = KlineWorker(self)
+		self.klineworkers = KlineWorkerPool(self, post=wx.CallAfter)
 
 		self.Layout()
 		self.mainsizer.Fit(self)
@@ -263,10 +286,15 @@ class HondaECU_ControlPanel(wx.Frame):
 		self.Show()
 
 		self.usbmonitor.start()
-		self.klineworker.start()
 
-	def __clear_data(self):
-		self.ecuinfo = {}
+	def __active_data(self):
+		if self.active_ftdi_device is None:
+			self.ecuinfo = {}
+		else:
+			if not self.active_ftdi_device in self.ecuinfos:
+				self.ecuinfos[self.active_ftdi_device] = {}
+			self.ecuinfo = self.ecuinfos[self.active_ftdi_device]
+		self.UpdateAppButtons()
 
 	def TunePanelHelperHandler(self, xdf, bin, metainfo, htf=None):
 		if htf != None:
@@ -299,25 +327,34 @@ class HondaECU_ControlPanel(wx.Frame):
 			fbin.close()
 			tp = TunePanel(self, metainfo, xdfs, byts)
 
-	def KlineWorkerHandler(self, info, value):
+	def UpdateAppButtons(self):
+		state = self.ecuinfo["state"] if "state" in self.ecuinfo else None
+		for a,d in self.apps.items():
+			if "enable" in d:
+				if state in d["enable"]:
+					self.appbuttons[a].Enable()
+				else:
+					self.appbuttons[a].Disable()
+
+	def KlineWorkerHandler(self, info, value, serial=None):
+		if not serial in self.ftdi_devices:
+			return
+		if not serial in self.ecuinfos:
+			self.ecuinfos[serial] = {}
+		ecuinfo = self.ecuinfos[serial]
 		if info in ["ecmid","flashcount","dtc","dtccount","state"]:
-			self.ecuinfo[info] = value
-			if info == "state":
-				 for a,d in self.apps.items():
-					 if "enable" in d:
-						 if value in d["enable"]:
-							 self.appbuttons[a].Enable()
-						 else:
-							 self.appbuttons[a].Disable()
+			ecuinfo[info] = value
+			if info == "state" and serial == self.active_ftdi_device:
+				self.UpdateAppButtons()
 		elif info == "data":
-			if not info in self.ecuinfo:
-				self.ecuinfo[info] = {}
-			self.ecuinfo[info][value[0]] = value[1:]
+			if not info in ecuinfo:
+				ecuinfo[info] = {}
+			ecuinfo[info][value.table] = value
 
 	def OnClose(self, event):
 		self.run = False
 		self.usbmonitor.join()
-		self.klineworker.join()
+		self.klineworkers.join()
 		for w in wx.GetTopLevelWindows():
 			w.Destroy()
 
@@ -353,34 +390,45 @@ class HondaECU_ControlPanel(wx.Frame):
 	def OnDebug(self, event):
 		self.debuglog.Show()
 
+	def AppKey(self, appid, serial=None):
+		if "perdevice" in self.apps[appid] and self.apps[appid]["perdevice"]:
+			return (appid, serial or self.active_ftdi_device)
+		return appid
+
 	def OnAppButtonClicked(self, event):
 		b = event.GetEventObject()
-		if not b.appid in self.appanels:
+		key = self.AppKey(b.appid)
+		if not key in self.appanels:
 			enablestates = None
 			if "enable" in self.apps[b.appid]:
 				enablestates = self.apps[b.appid]["enable"]
-			self.appanels[b.appid] = self.apps[b.appid]["panel"](self, b.appid, self.apps[b.appid], enablestates)
+			self.appanels[key] = self.apps[b.appid]["panel"](self, b.appid, self.apps[b.appid], enablestates)
 			self.appbuttons[b.appid].Disable()
-		self.appanels[b.appid].Raise()
+		self.appanels[key].Raise()
 
 	def USBMonitorHandler(self, action, vendor, product, serial):
 		dirty = False
 		if action == "add":
 			if not serial in self.ftdi_devices:
 				self.ftdi_devices[serial] = (vendor, product)
+				self.klineworkers.add(serial)
 				dirty = True
 		elif action =="remove":
 			if serial in self.ftdi_devices:
 				if serial == self.active_ftdi_device:
 					dispatcher.send(signal="FTDIDevice", sender=self, action="deactivate", vendor=vendor, product=product, serial=serial)
 					self.active_ftdi_device = None
-					self.__clear_data()
+				self.klineworkers.remove(serial)
 				del self.ftdi_devices[serial]
+				if serial in self.ecuinfos:
+					del self.ecuinfos[serial]
+				self.__active_data()
 				dirty = True
 		if len(self.ftdi_devices) > 0:
 			if not self.active_ftdi_device:
 				self.active_ftdi_device = list(self.ftdi_devices.keys())[0]
-				dispatcher.send(signal="FTDIDevice", sender=self, action="activate", vendor=vendor, product=product, serial=serial)
+				self.__active_data()
+				dispatcher.send(signal="FTDIDevice", sender=self, action="activate", vendor=self.ftdi_devices[self.active_ftdi_device][0], product=self.ftdi_devices[self.active_ftdi_device][1], serial=self.active_ftdi_device)
 				dirty = True
 		else:
 				pass
@@ -401,13 +449,14 @@ class HondaECU_ControlPanel(wx.Frame):
 		if s != self.active_ftdi_device:
 			if self.active_ftdi_device != None:
 				dispatcher.send(signal="FTDIDevice", sender=self, action="deactivate", vendor=self.ftdi_devices[self.active_ftdi_device], product=self.ftdi_devices[self.active_ftdi_device], serial=self.active_ftdi_device)
-			self.__clear_data()
 			self.active_ftdi_device = s
+			self.__active_data()
 			dispatcher.send(signal="FTDIDevice", sender=self, action="activate", vendor=self.ftdi_devices[self.active_ftdi_device], product=self.ftdi_devices[self.active_ftdi_device], serial=self.active_ftdi_device)
 			self.statusbar.SetStatusText("%s : %s : %s" % (self.ftdi_devices[self.active_ftdi_device][0], self.ftdi_devices[self.active_ftdi_device][1], self.active_ftdi_device), 0)
 
-	def AppPanelHandler(self, appid, action):
+	def AppPanelHandler(self, appid, action, serial=None):
 		if action == "close":
-			if appid in self.appanels:
-				del self.appanels[appid]
+			key = self.AppKey(appid, serial)
+			if key in self.appanels:
+				del self.appanels[key]
 				self.appbuttons[appid].Enable()
@@ -0,0 +1,108 @@
+import os
+import time
+import struct
+import numpy as np
+
+DATALOG_MAGIC = b"HDLG"
+DATALOG_VERSION = 1
+INDEX_MAGIC = b"HIDX"
+HEADER = struct.Struct("<4sBd5s")
+RECORD = struct.Struct("<dBH")
+INDEX_ENTRY = struct.Struct("<dQ")
+FOOTER = struct.Struct("<QI4s")
+INDEX_INTERVAL = 1.0
+
+class DatalogWriter(object):
+
+	def __init__(self, path, ecmid=b"", index_interval=INDEX_INTERVAL):
+		self.file = open(path, "wb")
+		self.index = []
+		self.index_interval = index_interval
+		self.next_index = 0
+		self.clock = time.perf_counter
+		self.start = self.clock()
+		self.file.write(HEADER.pack(DATALOG_MAGIC, DATALOG_VERSION, time.time(), bytes(ecmid)[:5]))
+
+	def append(self, table, payload, t=None):
+		if t is None:
+			t = self.clock() - self.start
+		if t >= self.next_index:
+			self.index.append((t, self.file.tell()))
+			self.next_index = t + self.index_interval
+		self.file.write(RECORD.pack(t, table, len(payload)))
+		self.file.write(payload)
+
+	def close(self):
+		offset = self.file.tell()
+		for t, o in self.index:
+			self.file.write(INDEX_ENTRY.pack(t, o))
+		self.file.write(FOOTER.pack(offset, len(self.index), INDEX_MAGIC))
+		self.file.close()
+
+class DatalogReader(object):
+
+	def __init__(self, path):
+		with open(path, "rb") as f:
+			self.buf = f.read()
+		magic, version, self.starttime, self.ecmid = HEADER.unpack_from(self.buf, 0)
+		if magic != DATALOG_MAGIC or version > DATALOG_VERSION:
+			raise ValueError("not a datalog file: %s" % path)
+		self.end = len(self.buf)
+		self.index = []
+		if len(self.buf) >= HEADER.size + FOOTER.size:
+			offset, count, magic = FOOTER.unpack_from(self.buf, len(self.buf) - FOOTER.size)
+			if magic == INDEX_MAGIC and offset + count*INDEX_ENTRY.size + FOOTER.size == len(self.buf):
+				self.end = offset
+				self.index = [INDEX_ENTRY.unpack_from(self.buf, offset + i*INDEX_ENTRY.size) for i in range(count)]
+		if not self.index:
+			self.index = self.rebuild_index()
+
+	def rebuild_index(self):
+		index = []
+		next_index = 0
+		for t, table, payload, offset in self.scan(HEADER.size):
+			if t >= next_index:
+				index.append((t, offset))
+				next_index = t + INDEX_INTERVAL
+		return index
+
+	def scan(self, offset):
+		buf = self.buf
+		while offset + RECORD.size <= self.end:
+			t, table, length = RECORD.unpack_from(buf, offset)
+			start = offset + RECORD.size
+			if start + length > self.end:
+				break
+			yield t, table, buf[start:start+length], offset
+			offset = start + length
+
+	def seek(self, t):
+		offset = HEADER.size
+		for it, io in self.index:
+			if it > t:
+				break
+			offset = io
+		return offset
+
+	def records(self, start=0, tables=None):
+		for t, table, payload, offset in self.scan(self.seek(start)):
+			if t < start:
+				continue
+			if tables is None or table in tables:
+				yield t, table, payload
+
+	def tables(self):
+		return sorted(set([table for t, table, payload in self.records()]))
+
+	def arrays(self, table, start=0):
+		times = []
+		payloads = []
+		for t, tb, payload in self.records(start, [table]):
+			if payloads and len(payload) != len(payloads[0]):
+				continue
+			times.append(t)
+			payloads.append(payload)
+		if not payloads:
+			return np.zeros(0), np.zeros((0, 0), dtype=np.uint8)
+		data = np.frombuffer(b"".join(payloads), dtype=np.uint8).reshape(len(payloads), -1)
+		return np.array(times), data
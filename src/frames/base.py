@@ -5,22 +5,39 @@ from pydispatch import dispatcher
 class HondaECU_AppPanel(wx.Frame):
 
 	def __init__(self, parent, appid, appinfo, enablestates, *args, **kwargs):
-		wx.Frame.__init__(self, parent, title="HondaECU :: %s" % (appinfo["label"]), style=wx.DEFAULT_FRAME_STYLE ^ wx.RESIZE_BORDER, *args, **kwargs)
+		serial = None
+		title = "HondaECU :: %s" % (appinfo["label"])
+		if "perdevice" in appinfo and appinfo["perdevice"]:
+			serial = parent.active_ftdi_device
+			title += " (%s)" % (serial)
+		wx.Frame.__init__(self, parent, title=title, style=wx.DEFAULT_FRAME_STYLE ^ wx.RESIZE_BORDER, *args, **kwargs)
+		self.serial = serial
 		self.parent = parent
 		self.appid = appid
 		self.appinfo = appinfo
 		self.enablestates = enablestates
 		self.Build()
-		dispatcher.connect(self.KlineWorkerHandler, signal="KlineWorker", sender=dispatcher.Any)
+		dispatcher.connect(self.KlineWorkerFilter, signal="KlineWorker", sender=dispatcher.Any)
 		dispatcher.connect(self.DeviceHandler, signal="FTDIDevice", sender=dispatcher.Any)
 		self.Bind(wx.EVT_CLOSE, self.OnClose)
 		self.Center()
 		wx.CallAfter(self.Show)
 
+	def ecuinfo(self):
+		if self.serial is None:
+			return self.parent.ecuinfo
+		if self.serial in self.parent.ecuinfos:
+			return self.parent.ecuinfos[self.serial]
+		return {}
+
 	def OnClose(self, event):
-		dispatcher.send(signal="AppPanel", sender=self, appid=self.appid, action="close")
+		dispatcher.send(signal="AppPanel", sender=self, appid=self.appid, action="close", serial=self.serial)
 		self.Destroy()
 
+	def KlineWorkerFilter(self, info, value, serial=None):
+		if serial is None or serial == (self.serial or self.parent.active_ftdi_device):
+			self.KlineWorkerHandler(info, value)
+
 	def KlineWorkerHandler(self, info, value):
 		pass
 
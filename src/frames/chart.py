@@ -0,0 +1,45 @@
+import wx
+import time
+
+CHART_WINDOW = 30.0
+CHART_HEIGHT = 60
+
+class StripChart(wx.Panel):
+
+	def __init__(self, parent, label, unit, window=CHART_WINDOW):
+		wx.Panel.__init__(self, parent, size=(-1, CHART_HEIGHT))
+		self.SetMinSize((300, CHART_HEIGHT))
+		self.SetBackgroundStyle(wx.BG_STYLE_PAINT)
+		self.label = label
+		self.unit = unit
+		self.window = window
+		self.source = None
+		self.Bind(wx.EVT_PAINT, self.OnPaint)
+		self.Bind(wx.EVT_SIZE, lambda e: self.Refresh())
+
+	def SetSource(self, ring, column):
+		self.source = (ring, column)
+
+	def OnPaint(self, event):
+		dc = wx.AutoBufferedPaintDC(self)
+		dc.SetBackground(wx.WHITE_BRUSH)
+		dc.Clear()
+		w, h = self.GetClientSize()
+		dc.SetPen(wx.LIGHT_GREY_PEN)
+		dc.DrawRectangle(0, 0, w, h)
+		text = self.label
+		if self.source is not None:
+			ring, column = self.source
+			end = ring.last() or time.time()
+			x, lo, hi = ring.minmax(column, end - self.window, end, w)
+			if len(x) > 0:
+				vmin = float(lo.min())
+				vmax = float(hi.max())
+				span = (vmax - vmin) or 1.0
+				y0 = h - 2 - (lo - vmin) / span * (h - 4)
+				y1 = h - 2 - (hi - vmin) / span * (h - 4)
+				dc.SetPen(wx.Pen(wx.Colour(0, 90, 180)))
+				dc.DrawLineList([(int(a), int(b), int(a), int(c) - 1) for a, b, c in zip(x, y0, y1)])
+				text = "%s  %g..%g %s" % (self.label, round(vmin, 2), round(vmax, 2), self.unit)
+		dc.SetTextForeground(wx.Colour(80, 80, 80))
+		dc.DrawText(text, 4, 2)
@@ -1,8 +1,12 @@
 import wx
-import struct
 from .base import HondaECU_AppPanel
 from pydispatch import dispatcher
 from eculib.honda import *
+from tables import MAIN_TABLES, get_layout
+from history import TableHistory
+from .chart import StripChart
+
+RENDER_INTERVAL = 100
 
 def changeFontInChildren(win, font):
     try:
@@ -20,30 +24,21 @@ class HondaECU_DatalogPanel(HondaECU_AppPanel):
 		self.appid = appid
 		self.appinfo = appinfo
 		self.enablestates = enablestates
+		self.serial = None
+		self.frames = {}
+		self.history = TableHistory()
+		self.charts = {}
+		self.toggles = {}
 		self.Build()
-		dispatcher.connect(self.KlineWorkerHandler, signal="KlineWorker", sender=dispatcher.Any)
+		self.timer = wx.Timer(self)
+		self.Bind(wx.EVT_TIMER, self.OnRender, self.timer)
+		self.timer.Start(RENDER_INTERVAL)
+		dispatcher.connect(self.KlineWorkerFilter, signal="KlineWorker", sender=dispatcher.Any)
 		dispatcher.connect(self.DeviceHandler, signal="FTDIDevice", sender=dispatcher.Any)
 		self.Bind(wx.EVT_CLOSE, self.OnClose)
 		self.Center()
 		wx.CallAfter(self.Show)
 
-	def prepare_data1(self, data, t):
-		if t in [0x13, 0x17]:
-			data = data[:9] + [0xff, 0xff] + data[9:]
-		data[1] = round(data[1]/0xff*5.0,2)
-		data[2] = round(data[2]/1.6,2)
-		data[3] = round(data[3]/0xff*5.0,2)
-		data[4] = -40 + data[4]
-		data[5] = round(data[5]/0xff*5.0,2)
-		data[6] = -40 + data[6]
-		data[7] = round(data[7]/0xff*5.0,2)
-		data[11] = round(data[11]/10,2)
-		data[13] = round(data[13]/0xffff*265.5,2)
-		data[14] = round(-64 + data[14]/0xff*127.5,2)
-		if t in [0x11]:
-			data[16] = round(data[16]/0xffff*8.0,4)
-		return data
-
 	def clear_tables(self):
 		for i,l in enumerate(self.sensors.keys()):
 			self.sensors[l][1].SetLabel("---")
@@ -74,37 +69,37 @@ class HondaECU_DatalogPanel(HondaECU_AppPanel):
 
 		self.maintable = None
 		self.sensors = {
-			"Engine speed": [None,None,None,"rpm",0,True,self.d1psizer,self.d1p],
-			"TPS sensor": [None,None,None,"%",2,True,self.d1psizer,self.d1p],
-			"ECT sensor": [None,None,None,"°C",4,True,self.d1psizer,self.d1p],
-			"IAT sensor": [None,None,None,"°C",6,True,self.d1psizer,self.d1p],
-			"MAP sensor": [None,None,None,"kPa",8,True,self.d1psizer,self.d1p],
-			"Battery voltage": [None,None,None,"V",11,True,self.d1psizer,self.d1p],
-			"Vehicle speed": [None,None,None,"Km/h",12,True,self.d1psizer,self.d1p],
-			"Injector duration": [None,None,None,"ms",13,True,self.d1psizer,self.d1p],
-			"Ignition advance": [None,None,None,"°",14,True,self.d1psizer,self.d1p],
-			"IACV pulse count": [None,None,None,"",15,True,self.d1psizer,self.d1p],
-			"IACV command": [None,None,None,"",16,True,self.d1psizer,self.d1p]
+			"Engine speed": [None,None,None,"rpm","engine_speed",True,self.d1psizer,self.d1p],
+			"TPS sensor": [None,None,None,"%","tps_sensor_scantool",True,self.d1psizer,self.d1p],
+			"ECT sensor": [None,None,None,"°C","ect_sensor_scantool",True,self.d1psizer,self.d1p],
+			"IAT sensor": [None,None,None,"°C","iat_sensor_scantool",True,self.d1psizer,self.d1p],
+			"MAP sensor": [None,None,None,"kPa","map_sensor_scantool",True,self.d1psizer,self.d1p],
+			"Battery voltage": [None,None,None,"V","battery_voltage",True,self.d1psizer,self.d1p],
+			"Vehicle speed": [None,None,None,"Km/h","vehicle_speed",True,self.d1psizer,self.d1p],
+			"Injector duration": [None,None,None,"ms","injector_duration",True,self.d1psizer,self.d1p],
+			"Ignition advance": [None,None,None,"°","ignition_advance",True,self.d1psizer,self.d1p],
+			"IACV pulse count": [None,None,None,"","iacv_pulse_count",True,self.d1psizer,self.d1p],
+			"IACV command": [None,None,None,"","iacv_command",True,self.d1psizer,self.d1p]
 		}
 		self.o2sensor = {
 			0x20: {
-				"O2 sensor #1": [None,None,None,"V",0,True,self.d2psizer,self.d2p,self.d2pbox],
-				"O2 heater #1": [None,None,None,"V",2,True,self.d2psizer,self.d2p,self.d2pbox],
-				"STFT #1": [None,None,None,"",1,True,self.d2psizer,self.d2p,self.d2pbox]
+				"O2 sensor #1": [None,None,None,"V","o2_sensor_voltage",True,self.d2psizer,self.d2p,self.d2pbox],
+				"O2 heater #1": [None,None,None,"V","o2_heater_voltage",True,self.d2psizer,self.d2p,self.d2pbox],
+				"STFT #1": [None,None,None,"","stft",True,self.d2psizer,self.d2p,self.d2pbox]
 			},
 			0x21: {
-				"O2 sensor #2": [None,None,None,"V",0,True,self.d3psizer,self.d3p,self.d3pbox],
-				"O2 heater #2": [None,None,None,"V",2,True,self.d3psizer,self.d3p,self.d3pbox],
-				"STFT #2": [None,None,None,"",1,True,self.d3psizer,self.d3p,self.d3pbox]
+				"O2 sensor #2": [None,None,None,"V","o2_sensor_voltage",True,self.d3psizer,self.d3p,self.d3pbox],
+				"O2 heater #2": [None,None,None,"V","o2_heater_voltage",True,self.d3psizer,self.d3p,self.d3pbox],
+				"STFT #2": [None,None,None,"","stft",True,self.d3psizer,self.d3p,self.d3pbox]
 			},
 		}
 		self.sensors2 = {
-			"EGCV current": [None,None,None,"V",5,True,self.d4psizer,self.d4p,self.d4pbox],
-			"EGCV target": [None,None,None,"V",6,True,self.d4psizer,self.d4p,self.d4pbox],
-			"EGCV load": [None,None,None,"%",7,True,self.d4psizer,self.d4p,self.d4pbox],
-			"HESD current": [None,None,None,"A",8,True,self.d4psizer,self.d4p,self.d4pbox],
-			"HESD target": [None,None,None,"A",9,True,self.d4psizer,self.d4p,self.d4pbox],
-			"HESD load": [None,None,None,"%",10,True,self.d4psizer,self.d4p,self.d4pbox]
+			"EGCV current": [None,None,None,"V","egcv_current",True,self.d4psizer,self.d4p,self.d4pbox],
+			"EGCV target": [None,None,None,"V","egcv_target",True,self.d4psizer,self.d4p,self.d4pbox],
+			"EGCV load": [None,None,None,"%","egcv_load",True,self.d4psizer,self.d4p,self.d4pbox],
+			"HESD current": [None,None,None,"A","hesd_current",True,self.d4psizer,self.d4p,self.d4pbox],
+			"HESD target": [None,None,None,"A","hesd_target",True,self.d4psizer,self.d4p,self.d4pbox],
+			"HESD load": [None,None,None,"%","hesd_load",True,self.d4psizer,self.d4p,self.d4pbox]
 		}
 		for i,l in enumerate(self.sensors.keys()):
 			self.sensors[l][0] = wx.StaticText(self.sensors[l][7], label="%s:" % l)
@@ -115,7 +110,7 @@ class HondaECU_DatalogPanel(HondaECU_AppPanel):
 			self.sensors[l][6].Add(wx.StaticText(self.sensors[l][7], label=" "), pos=(i,2))
 			self.sensors[l][6].Add(self.sensors[l][1], pos=(i,3), flag=wx.ALIGN_CENTER_VERTICAL|wx.ALIGN_RIGHT|wx.ALL, border=5)
 			self.sensors[l][6].Add(self.sensors[l][2], pos=(i,4), flag=wx.ALIGN_CENTER_VERTICAL|wx.ALIGN_LEFT|wx.ALL, border=5)
-			self.sensors[l][6].Add(wx.StaticText(self.sensors[l][7], label=" "), pos=(i,5))
+			self.sensors[l][6].Add(self.ChartToggle(None, l, self.sensors[l]), pos=(i,5), flag=wx.ALIGN_CENTER_VERTICAL|wx.RIGHT, border=5)
 		for i,l in enumerate(self.sensors2.keys()):
 			self.sensors2[l][0] = wx.StaticText(self.sensors2[l][7], label="%s:" % l)
 			self.sensors2[l][1] = wx.StaticText(self.sensors2[l][7], label="---")
@@ -125,7 +120,7 @@ class HondaECU_DatalogPanel(HondaECU_AppPanel):
 			self.sensors2[l][6].Add(wx.StaticText(self.sensors2[l][7], label=" "), pos=(i,2))
 			self.sensors2[l][6].Add(self.sensors2[l][1], pos=(i,3), flag=wx.ALIGN_CENTER_VERTICAL|wx.ALIGN_RIGHT|wx.ALL, border=5)
 			self.sensors2[l][6].Add(self.sensors2[l][2], pos=(i,4), flag=wx.ALIGN_CENTER_VERTICAL|wx.ALIGN_LEFT|wx.ALL, border=5)
-			self.sensors2[l][6].Add(wx.StaticText(self.sensors2[l][7], label=" "), pos=(i,5))
+			self.sensors2[l][6].Add(self.ChartToggle(0xd0, l, self.sensors2[l]), pos=(i,5), flag=wx.ALIGN_CENTER_VERTICAL|wx.RIGHT, border=5)
 		for j in self.o2sensor:
 			for i,l in enumerate(self.o2sensor[j].keys()):
 				self.o2sensor[j][l][0] = wx.StaticText(self.o2sensor[j][l][7], label="%s:" % l)
@@ -136,13 +131,14 @@ class HondaECU_DatalogPanel(HondaECU_AppPanel):
 				self.o2sensor[j][l][6].Add(wx.StaticText(self.o2sensor[j][l][7], label=" "), pos=(i,2))
 				self.o2sensor[j][l][6].Add(self.o2sensor[j][l][1], pos=(i,3), flag=wx.ALIGN_CENTER_VERTICAL|wx.ALIGN_RIGHT|wx.ALL, border=5)
 				self.o2sensor[j][l][6].Add(self.o2sensor[j][l][2], pos=(i,4), flag=wx.ALIGN_CENTER_VERTICAL|wx.ALIGN_LEFT|wx.ALL, border=5)
-				self.o2sensor[j][l][6].Add(wx.StaticText(self.o2sensor[j][l][7], label=" "), pos=(i,5))
+				self.o2sensor[j][l][6].Add(self.ChartToggle(j, l, self.o2sensor[j][l]), pos=(i,5), flag=wx.ALIGN_CENTER_VERTICAL|wx.RIGHT, border=5)
 		if "data" in self.parent.ecuinfo:
 			if not self.parent.ecuinfo["data"] in [0x11]:
 				for s in ["IACV pulse count","IACV command"]:
 					self.sensors[s][0].Hide()
 					self.sensors[s][1].Hide()
 					self.sensors[s][2].Hide()
+					self.toggles[s].Hide()
 					self.sensors[s][5] = False
 			if not 0x20 in self.parent.ecuinfo["data"]:
 				self.d2pbox.Disable()
@@ -150,44 +146,16 @@ class HondaECU_DatalogPanel(HondaECU_AppPanel):
 				self.d3pbox.Disable()
 			if not 0xd0 in self.parent.ecuinfo["data"]:
 				self.d4pbox.Disable()
-			for t in [0x10,0x11,0x13,0x17]:
+			for t in MAIN_TABLES:
 				if t in self.parent.ecuinfo["data"]:
-					u = ">H12B"
-					if t is not 0x13:
-						u += "HB"
-						if t == 0x11:
-							u += "BH"
-						elif t == 0x17:
-							u += "BB"
-					data = self.prepare_data1(list(struct.unpack(u, self.parent.ecuinfo["data"][t][1][2:])), t)
-					for s in self.sensors:
-						if self.sensors[s][5]:
-							self.sensors[s][1].SetLabel(str(data[self.sensors[s][4]]))
+					self.update_sensors(self.sensors, self.parent.ecuinfo["data"][t])
 					self.maintable = t
 					break
 			for t in [0x20,0x21]:
 				if t in self.parent.ecuinfo["data"]:
-					data = list(struct.unpack(">3B", self.parent.ecuinfo["data"][t][1][2:]))
-					data[0] = round(data[0]/0xff*5, 2)
-					data[1] = round(data[1]/0xff*2, 4)
-					data[2] = round(data[2]/0xff*5, 2)
-					for s in self.o2sensor[t]:
-						if self.o2sensor[t][s][5]:
-							self.o2sensor[t][s][1].SetLabel(str(data[self.o2sensor[t][s][4]]))
-							self.o2sensor[t][s][8].Show()
-			if t == 0xd0:
-				if t in self.parent.ecuinfo["data"]:
-					data = list(struct.unpack(">7Bb%dB" % (self.parent.ecuinfo["data"][t][0]-10), self.parent.ecuinfo["data"][t][1][2:]))
-					data[5] = round(data[5]/0xff*5, 3)
-					data[6] = round(data[6]/0xff*5, 3)
-					data[7] = round(data[7]/0xff*100, 2)
-					data[8] = round(data[8]/0xff*5, 3)
-					data[9] = round(data[9]/0xff*5, 3)
-					data[10] = round(data[10]/0xff*5, 2)
-					for s in self.sensors2:
-						if self.sensors2[s][5]:
-							self.sensors2[s][1].SetLabel(str(data[self.sensors2[s][4]]))
-							self.sensors2[s][8].Show()
+					self.update_sensors(self.o2sensor[t], self.parent.ecuinfo["data"][t])
+			if 0xd0 in self.parent.ecuinfo["data"]:
+				self.update_sensors(self.sensors2, self.parent.ecuinfo["data"][0xd0])
 
 		self.d1p.SetSizer(self.d1psizer)
 		self.d2p.SetSizer(self.d2psizer)
@@ -223,6 +191,8 @@ class HondaECU_DatalogPanel(HondaECU_AppPanel):
 
 		self.mainsizer = wx.BoxSizer(wx.VERTICAL)
 		self.mainsizer.Add(self.datap, 1, wx.EXPAND)
+		self.chartsizer = wx.BoxSizer(wx.VERTICAL)
+		self.mainsizer.Add(self.chartsizer, 0, wx.EXPAND|wx.LEFT|wx.RIGHT|wx.BOTTOM, border=10)
 
 		self.d2pbox.Disable()
 		self.d3pbox.Disable()
@@ -260,78 +230,106 @@ class HondaECU_DatalogPanel(HondaECU_AppPanel):
 		accel_tbl = wx.AcceleratorTable(at)
 		self.SetAcceleratorTable(accel_tbl)
 
-	def OnBig(self, event):
-		f = self.fonts[event.GetId()]
-		changeFontInChildren(self, f[0])
-		for s in [self.d1psizer, self.d2psizer, self.d3psizer, self.d4psizer]:
-			s.SetHGap(f[1])
+	def update_sensors(self, sensors, frame):
+		if frame.values is None:
+			return
+		layout = frame.layout
+		data = layout.display(frame.values)
+		for s in sensors:
+			if sensors[s][5] and sensors[s][4] in layout.index:
+				label = str(data[layout.index[sensors[s][4]]])
+				if sensors[s][1].GetLabel() != label:
+					sensors[s][1].SetLabel(label)
+
+	def ChartToggle(self, table, label, sensor):
+		# StaticText gets no mouse events on GTK, so charts are toggled with a button
+		b = wx.ToggleButton(sensor[7], label="~", style=wx.BU_EXACTFIT)
+		b.SetToolTip("Show %s chart" % label)
+		b.Bind(wx.EVT_TOGGLEBUTTON, lambda e: self.OnToggleChart(table, label, sensor))
+		self.toggles[label] = b
+		return b
+
+	def OnToggleChart(self, table, label, sensor):
+		if label in self.charts:
+			self.charts[label][0].Destroy()
+			del self.charts[label]
+		else:
+			chart = StripChart(self, label, sensor[3])
+			self.chartsizer.Add(chart, 0, wx.EXPAND|wx.TOP, border=5)
+			self.charts[label] = (chart, table, sensor[4])
 		self.Layout()
 		self.mainsizer.Fit(self)
 
-	def OnClose(self, event):
-		wx.CallAfter(dispatcher.send, signal="DatalogPanel", sender=self, action="data.off")
-		HondaECU_AppPanel.OnClose(self, event)
-
-	def KlineWorkerHandler(self, info, value):
-		if info == "data":
-			t = value[0]
-			d = value[2][2:]
-			if t in [0x10,0x11,0x13,0x17]:
-				u = ">H12B"
-				if t is not 0x13:
-					u += "HB"
-					if t == 0x11:
-						u += "BH"
-					elif t == 0x17:
-						u += "BB"
-				data = self.prepare_data1(list(struct.unpack(u, self.parent.ecuinfo["data"][t][1][2:])), t)
-				for s in self.sensors:
-					if self.sensors[s][5]:
-						self.sensors[s][1].SetLabel(str(data[self.sensors[s][4]]))
+	def OnRender(self, event):
+		# charts keep scrolling while the ecu is silent
+		for chart, table, field in self.charts.values():
+			if table is None:
+				table = self.maintable
+			ring = self.history.get(table)
+			if ring is not None and chart.source is None:
+				layout = get_layout(table)
+				if field in layout.index:
+					chart.SetSource(ring, layout.index[field])
+			chart.Refresh()
+		if not self.frames:
+			return
+		frames = self.frames
+		self.frames = {}
+		relayout = False
+		for t, frame in frames.items():
+			if t in MAIN_TABLES:
+				self.update_sensors(self.sensors, frame)
 				if self.maintable is None:
 					if not t in [0x11]:
 						for s in ["IACV pulse count","IACV command"]:
 							self.sensors[s][0].Hide()
 							self.sensors[s][1].Hide()
 							self.sensors[s][2].Hide()
+							self.toggles[s].Hide()
 							self.sensors[s][5] = False
-							self.Layout()
-							self.mainsizer.Fit(self)
 					self.maintable = t
 					mt = "0x%x" % self.maintable
 					self.d1pboxsizer.GetStaticBox().SetLabel("Table " + mt)
-			if t in [0x20,0x21]:
-				data = list(struct.unpack(">3B", self.parent.ecuinfo["data"][t][1][2:]))
-				data[0] = round(data[0]/0xff*5, 2)
-				data[1] = round(data[1]/0xff*2, 4)
-				data[2] = round(data[2]/0xff*5, 2)
-				for s in self.o2sensor[t]:
-					if self.o2sensor[t][s][5]:
-						self.o2sensor[t][s][1].SetLabel(str(data[self.o2sensor[t][s][4]]))
-						self.o2sensor[t][s][8].Enable()
-						self.Layout()
-						self.mainsizer.Fit(self)
-			if t == 0xd0:
-				if t in self.parent.ecuinfo["data"]:
-					data = list(struct.unpack(">7Bb%dB" % (self.parent.ecuinfo["data"][t][0]-10), self.parent.ecuinfo["data"][t][1][2:]))
-					data[5] = round(data[5]/0xff*5, 3)
-					data[6] = round(data[6]/0xff*5, 3)
-					# data[7] = round(data[7]/0xff*5, 2)
-					data[8] = round(data[8]/0xff*5, 3)
-					data[9] = round(data[9]/0xff*5, 3)
-					# data[10] = round(data[10]/0xff*5, 2)
-					for s in self.sensors2:
-						if self.sensors2[s][5]:
-							self.sensors2[s][1].SetLabel(str(data[self.sensors2[s][4]]))
-							self.sensors2[s][8].Enable()
-							self.Layout()
-							self.mainsizer.Fit(self)
+					relayout = True
+			elif t in [0x20,0x21]:
+				self.update_sensors(self.o2sensor[t], frame)
+				box = self.o2sensor[t][list(self.o2sensor[t].keys())[0]][8]
+				if not box.IsEnabled():
+					box.Enable()
+					relayout = True
+			elif t == 0xd0:
+				self.update_sensors(self.sensors2, frame)
+				box = self.sensors2[list(self.sensors2.keys())[0]][8]
+				if not box.IsEnabled():
+					box.Enable()
+					relayout = True
+		if relayout:
+			self.Layout()
+			self.mainsizer.Fit(self)
+
+	def OnBig(self, event):
+		f = self.fonts[event.GetId()]
+		changeFontInChildren(self, f[0])
+		for s in [self.d1psizer, self.d2psizer, self.d3psizer, self.d4psizer]:
+			s.SetHGap(f[1])
+		self.Layout()
+		self.mainsizer.Fit(self)
+
+	def OnClose(self, event):
+		self.timer.Stop()
+		wx.CallAfter(dispatcher.send, signal="DatalogPanel", sender=self, action="data.off")
+		HondaECU_AppPanel.OnClose(self, event)
 
+	def KlineWorkerHandler(self, info, value):
+		if info == "data":
+			self.history.add(value)
+			self.frames[value.table] = value
 		elif info == "state":
 			if value == ECUSTATE.OK:
 				wx.CallAfter(dispatcher.send, signal="DatalogPanel", sender=self, action="data.on")
 			else:
 				wx.CallAfter(dispatcher.send, signal="DatalogPanel", sender=self, action="data.off")
+				self.frames = {}
 				self.clear_tables()
 				self.maintable = None
 				self.d1pboxsizer.GetStaticBox().SetLabel("Table 0x??")
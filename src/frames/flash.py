@@ -7,6 +7,8 @@ import json
 from .base import HondaECU_AppPanel
 from pydispatch import dispatcher
 
+from transfer import ReadCheckpoint, DEFAULT_PASSWORD, load_bin, load_htf
+
 from eculib.honda import *
 
 class CharValidator(wx.Validator):
@@ -47,6 +49,7 @@ class HondaECU_FlashPanel(HondaECU_AppPanel):
 			self.wildcard = "HondaECU supported files (*.htf,*.bin)|*.htf;*.bin|HondaECU tune file (*.htf)|*.htf|ECU dump (*.bin)|*.bin"
 		self.byts = None
 		self.bootwait = False
+		self.readblocksize = None
 		self.statusbar = self.CreateStatusBar(1)
 		self.statusbar.SetSize((-1, 28))
 		self.statusbar.SetStatusStyles([wx.SB_SUNKEN])
@@ -64,6 +67,7 @@ class HondaECU_FlashPanel(HondaECU_AppPanel):
 		self.offsetl = wx.StaticText(self.optsp,label="Start Offset")
 		self.offset = wx.TextCtrl(self.optsp)
 		self.offset.SetValue("0x0")
+		self.skipblank = wx.CheckBox(self.optsp, label="Skip blank blocks")
 		self.htfoffset = None
 
 		self.gobutton = wx.Button(self.mainp, label="Read")
@@ -76,6 +80,7 @@ class HondaECU_FlashPanel(HondaECU_AppPanel):
 		self.optsbox.Add(self.wchecksuml, 0, flag=wx.ALIGN_RIGHT|wx.ALIGN_CENTER_VERTICAL|wx.LEFT, border=10)
 		self.optsbox.Add(self.checksum, 0, flag=wx.LEFT, border=5)
 		self.optsbox.Add(self.fixchecksum, 0, flag=wx.ALIGN_LEFT|wx.ALIGN_CENTER_VERTICAL|wx.LEFT, border=10)
+		self.optsbox.Add(self.skipblank, 0, flag=wx.ALIGN_LEFT|wx.ALIGN_CENTER_VERTICAL|wx.LEFT, border=10)
 		self.optsp.SetSizer(self.optsbox)
 
 		self.fpickerbox = wx.BoxSizer(wx.HORIZONTAL)
@@ -95,7 +100,7 @@ class HondaECU_FlashPanel(HondaECU_AppPanel):
 		self.passp.SetSizer(self.passpsizer)
 		self.passboxp.SetSizer(self.passboxsizer)
 		self.password_chars = []
-		for i, val in enumerate([0x48, 0x65, 0x6c, 0x6c, 0x6f, 0x48, 0x6f, 0x77, 0x41, 0x72, 0x65, 0x59, 0x6f, 0x75]):
+		for i, val in enumerate(DEFAULT_PASSWORD):
 			H = "%2X" % val
 			self.password_chars.append([
 				wx.StaticText(self.passp, size=(32,-1), label="%s" % chr(val), style=wx.ALIGN_CENTRE_HORIZONTAL),
@@ -181,6 +186,15 @@ class HondaECU_FlashPanel(HondaECU_AppPanel):
 
 	def OnReadPicker(self, event):
 		self.OnValidateMode(None)
+		resume = None
+		try:
+			resume = ReadCheckpoint(self.readfpicker.GetPath()).load(int(self.offset.GetValue(), 16))
+		except ValueError:
+			pass
+		if resume:
+			self.statusbar.SetStatusText("Read: will resume at %.02fKB" % ((int(self.offset.GetValue(), 16)+len(resume))/1024.0), 0)
+		else:
+			self.statusbar.SetStatusText("", 0)
 
 	def OnWritePicker(self, event):
 		self.OnWriteFileSelected(None)
@@ -203,9 +217,11 @@ class HondaECU_FlashPanel(HondaECU_AppPanel):
 			self.fixchecksum.Hide()
 			self.offsetl.Show()
 			self.offset.Show()
+			self.skipblank.Hide()
 			self.passboxp.Show()
 			self.progress.Hide()
 		else:
+			self.skipblank.Show()
 			self.passboxp.Hide()
 			self.progress.Show()
 			self.gobutton.SetLabel("Write")
@@ -229,9 +245,20 @@ class HondaECU_FlashPanel(HondaECU_AppPanel):
 				self.passboxp.Show()
 				self.Layout()
 			self.statusbar.SetStatusText("Read: " + value[1], 0)
+		elif info == "read.transfer":
+			pulse = time.time()
+			if pulse - self.lastpulse > .2:
+				self.progress.Pulse()
+				self.lastpulse = pulse
+			self.statusbar.SetStatusText("Read: %.02fKB @ %s" % (value["done"]/1024.0, "%.02fB/s" % value["rate"] if value["rate"] > 0 else "---"), 0)
+		elif info == "read.blocksize":
+			self.readblocksize = value
 		elif info == "read.result":
 			self.progress.SetValue(0)
-			self.statusbar.SetStatusText("Read: complete (result=%s)" % value, 0)
+			if self.readblocksize:
+				self.statusbar.SetStatusText("Read: complete (result=%s, block size=%d)" % (value, self.readblocksize), 0)
+			else:
+				self.statusbar.SetStatusText("Read: complete (result=%s)" % value, 0)
 			self.progress.Hide()
 			self.passboxp.Show()
 			self.Layout()
@@ -244,6 +271,10 @@ class HondaECU_FlashPanel(HondaECU_AppPanel):
 					self.progress.Pulse()
 					self.lastpulse = pulse
 			self.statusbar.SetStatusText("Write: " + value[1], 0)
+		elif info == "write.transfer":
+			if value["total"] > 0:
+				self.progress.SetValue(int(value["done"]/value["total"]*100))
+			self.statusbar.SetStatusText("Write: %.02fKB of %.02fKB @ %s" % (value["position"]/1024.0, value["size"]/1024.0, "%.02fB/s" % value["rate"] if value["rate"] > 0 else "---"), 0)
 		elif info == "write.result":
 			self.progress.SetValue(0)
 			self.statusbar.SetStatusText("Write: complete (result=%s)" % value, 0)
@@ -264,28 +295,29 @@ class HondaECU_FlashPanel(HondaECU_AppPanel):
 	def OnGo(self, event):
 		self.gobutton.Disable()
 		if self.modebox.GetSelection() == 0:
+			self.readblocksize = None
 			offset = int(self.offset.GetValue(), 16)
 			data = self.readfpicker.GetPath()
-			if self.parent.ecuinfo["state"] != ECUSTATE.READ:
+			if self.ecuinfo()["state"] != ECUSTATE.READ:
 				self.bootwait = True
 				self.statusbar.SetStatusText("Turn off ECU!", 0)
 			self.progress.Show()
 			self.passboxp.Hide()
 			self.Layout()
 			passwd = [int(P[1].GetValue(),16) for P in self.password_chars]
-			dispatcher.send(signal="ReadPanel", sender=self, data=data, offset=offset, passwd=passwd)
+			dispatcher.send(signal="ReadPanel", sender=self, data=data, offset=offset, passwd=passwd, serial=self.serial)
 		else:
 			if self.htfoffset != None:
 				offset = int(self.htfoffset, 16)
 			else:
 				offset = int(self.offset.GetValue(), 16)
 			self.gobutton.Disable()
-			dispatcher.send(signal="WritePanel", sender=self, data=self.byts, offset=offset)
+			dispatcher.send(signal="WritePanel", sender=self, data=self.byts, offset=offset, skipblank=self.skipblank.IsChecked(), serial=self.serial)
 
 	def OnValidateMode(self, event):
 		enable = False
-		if "state" in self.parent.ecuinfo:
-			if self.parent.ecuinfo["state"] in [ECUSTATE.OK, ECUSTATE.RECOVER_OLD, ECUSTATE.RECOVER_NEW, ECUSTATE.WRITEx00, ECUSTATE.WRITEx30, ECUSTATE.READ]:
+		if "state" in self.ecuinfo():
+			if self.ecuinfo()["state"] in [ECUSTATE.OK, ECUSTATE.RECOVER_OLD, ECUSTATE.RECOVER_NEW, ECUSTATE.WRITEx00, ECUSTATE.WRITEx30, ECUSTATE.READ]:
 				if self.modebox.GetSelection() == 0:
 					offset = None
 					try:
@@ -307,31 +339,9 @@ class HondaECU_FlashPanel(HondaECU_AppPanel):
 	def OnValidateModeHTF(self, event):
 		if len(self.writefpicker.GetPath()) > 0:
 			if os.path.isfile(self.writefpicker.GetPath()):
-				tar = tarfile.open(self.writefpicker.GetPath(), "r:xz")
-				binmod = None
-				metainfo = None
-				for f in tar.getnames():
-					if f == "metainfo.json":
-						metainfo = json.load(tar.extractfile(f))
-					else:
-						b,e = os.path.splitext(f)
-						if e == ".bin":
-							x, y = os.path.splitext(b)
-							if y == ".mod":
-								binmod = bytearray(tar.extractfile(f).read())
-				if binmod != None and metainfo != None:
-					ea = int(metainfo["ecmidaddr"],16)
-					ka = int(metainfo["keihinaddr"],16)
-					if "offset" in metainfo:
-						self.htfoffset = metainfo["offset"]
-					if "rid" in metainfo and metainfo["rid"] != None:
-						for i in range(5):
-							binmod[ea+i] ^= 0xFF
-						for i in range(7):
-							binmod[ka+i] = ord(metainfo["rid"][i])
-					ret, status, self.byts = do_validation(binmod, len(binmod), int(metainfo["checksum"],16))
-					if status != "bad":
-						return True
+				status, self.byts, self.htfoffset = load_htf(self.writefpicker.GetPath())
+				if status != "bad":
+					return True
 		return False
 
 	def OnValidateModeBin(self, event):
@@ -348,13 +358,7 @@ class HondaECU_FlashPanel(HondaECU_AppPanel):
 				return False
 		if len(self.writefpicker.GetPath()) > 0:
 			if os.path.isfile(self.writefpicker.GetPath()):
-				fbin = open(self.writefpicker.GetPath(), "rb")
-				nbyts = os.path.getsize(self.writefpicker.GetPath())
-				byts = bytearray(fbin.read(nbyts))
-				fbin.close()
-				if checksum >= nbyts:
-					return False
-				ret, status, self.byts = do_validation(byts, nbyts, checksum)
+				status, self.byts = load_bin(self.writefpicker.GetPath(), checksum)
 				if status != "bad":
 					return True
 		return False
@@ -7,206 +7,15 @@ import wx.lib.agw.aui.auibook
 import wx.dataview as dv
 import wx.grid as gridlib
 import numpy as np
-from lxml import etree
-import struct
-import operator
-import math
 import tarfile
-from pyparsing import (Literal, CaselessLiteral, Word, Combine, Group, Optional,
-					   ZeroOrMore, Forward, nums, alphas, oneOf)
+from xdfmath import compile_equation, inverse_equation
+from xdfindex import XDFIndexCache
 
 import colour
 red = colour.Color("blue")
 colors = list(red.range_to(colour.Color("red"),100))
 colors = [wx.Colour(c.red*255,c.green*255,c.blue*255) for c in colors]
 
-class NumericStringParser(object):
-	'''
-	Most of this code comes from the fourFn.py pyparsing example
-
-	'''
-
-	def pushFirst(self, strg, loc, toks):
-		self.exprStack.append(toks[0])
-
-	def pushUMinus(self, strg, loc, toks):
-		if toks and toks[0] == '-':
-			self.exprStack.append('unary -')
-
-	def __init__(self):
-		"""
-		expop   :: '^'
-		multop  :: '*' | '/'
-		addop   :: '+' | '-'
-		integer :: ['+' | '-'] '0'..'9'+
-		atom    :: PI | E | real | fn '(' expr ')' | '(' expr ')'
-		factor  :: atom [ expop factor ]*
-		term    :: factor [ multop factor ]*
-		expr    :: term [ addop term ]*
-		"""
-		point = Literal(".")
-		e = CaselessLiteral("E")
-		fnumber = Combine(Word("+-" + nums, nums) +
-						  Optional(point + Optional(Word(nums))) +
-						  Optional(e + Word("+-" + nums, nums)))
-		ident = Word(alphas, alphas + nums + "_$")
-		plus = Literal("+")
-		minus = Literal("-")
-		mult = Literal("*")
-		div = Literal("/")
-		lpar = Literal("(").suppress()
-		rpar = Literal(")").suppress()
-		addop = plus | minus
-		multop = mult | div
-		expop = Literal("^")
-		pi = CaselessLiteral("PI")
-		expr = Forward()
-		atom = ((Optional(oneOf("- +")) +
-				 (ident + lpar + expr + rpar | pi | e | fnumber).setParseAction(self.pushFirst))
-				| Optional(oneOf("- +")) + Group(lpar + expr + rpar)
-				).setParseAction(self.pushUMinus)
-		# by defining exponentiation as "atom [ ^ factor ]..." instead of
-		# "atom [ ^ atom ]...", we get right-to-left exponents, instead of left-to-right
-		# that is, 2^3^2 = 2^(3^2), not (2^3)^2.
-		factor = Forward()
-		factor << atom + \
-			ZeroOrMore((expop + factor).setParseAction(self.pushFirst))
-		term = factor + \
-			ZeroOrMore((multop + factor).setParseAction(self.pushFirst))
-		expr << term + \
-			ZeroOrMore((addop + term).setParseAction(self.pushFirst))
-		# addop_term = ( addop + term ).setParseAction( self.pushFirst )
-		# general_term = term + ZeroOrMore( addop_term ) | OneOrMore( addop_term)
-		# expr <<  general_term
-		self.bnf = expr
-		# map operator symbols to corresponding arithmetic operations
-		epsilon = 1e-12
-		self.opn = {"+": operator.add,
-					"-": operator.sub,
-					"*": operator.mul,
-					"/": operator.truediv,
-					"^": operator.pow}
-		self.fn = {"sin": math.sin,
-				   "cos": math.cos,
-				   "tan": math.tan,
-				   "exp": math.exp,
-				   "abs": abs,
-				   "trunc": lambda a: int(a),
-				   "round": round,
-				   "sgn": lambda a: abs(a) > epsilon and cmp(a, 0) or 0}
-
-	def evaluateStack(self, s):
-		op = s.pop()
-		if op == 'unary -':
-			return -self.evaluateStack(s)
-		if op in "+-*/^":
-			op2 = self.evaluateStack(s)
-			op1 = self.evaluateStack(s)
-			return self.opn[op](op1, op2)
-		elif op == "PI":
-			return math.pi  # 3.1415926535
-		elif op == "E":
-			return math.e  # 2.718281828
-		elif op in self.fn:
-			return self.fn[op](self.evaluateStack(s))
-		elif op[0].isalpha():
-			return 0
-		else:
-			return float(op)
-
-	def eval(self, num_string, parseAll=True):
-		self.exprStack = []
-		results = self.bnf.parseString(num_string, parseAll)
-		val = self.evaluateStack(self.exprStack[:])
-		return val
-nsp = NumericStringParser()
-
-def get_table_info(t):
-	n = t.xpath("title")[0].text
-	# x-axis
-	xxx = t.xpath("XDFAXIS[@id='x']")[0]
-	xindexcount = int(xxx.xpath("indexcount")[0].text)
-	e = xxx.xpath("embedinfo")
-	if len(e) > 0:
-		xtype = int(e[0].get("type"))
-		xlinkobjid = e[0].get("linkobjid")
-	else:
-		xtype = None
-		xlinkobjid = None
-	xot = xxx.xpath("outputtype")
-	if len(xot) > 0:
-		xot = xot[0].text
-	else:
-		xot = None
-	xdp = xxx.xpath("decimalpl")
-	if len(xdp) > 0:
-		xdp = xdp[0].text
-	else:
-		xdp = None
-	# y-axis
-	yyy = t.xpath("XDFAXIS[@id='y']")[0]
-	yindexcount = int(yyy.xpath("indexcount")[0].text)
-	e = yyy.xpath("embedinfo")
-	if len(e) > 0:
-		ytype = int(e[0].get("type"))
-		ylinkobjid = e[0].get("linkobjid")
-	else:
-		ytype = None
-		ylinkobjid = None
-	yot = yyy.xpath("outputtype")
-	if len(yot) > 0:
-		yot = yot[0].text
-	else:
-		yot = None
-	ydp = yyy.xpath("decimalpl")
-	if len(ydp) > 0:
-		ydp = ydp[0].text
-	else:
-		ydp = None
-	# z-axis
-	zzz = t.xpath("XDFAXIS[@id='z']")[0]
-	m = zzz.xpath("MATH")
-	if len(m) > 0:
-		eq = m[0].get('equation')
-	else:
-		eq = None
-	zot = zzz.xpath("outputtype")
-	if len(zot) > 0:
-		zot = zot[0].text
-	else:
-		zot = None
-	zdp = zzz.xpath("decimalpl")
-	if len(zdp) > 0:
-		zdp = zdp[0].text
-	else:
-		zdp = None
-	zmin = zzz.xpath("min")
-	if len(zmin) > 0:
-		zmin = zmin[0].text
-	else:
-		zmax = None
-	zmax = zzz.xpath("max")
-	if len(zmax) > 0:
-		zmax = zmax[0].text
-	else:
-		zmax = None
-	e = zzz.xpath("EMBEDDEDDATA")[0]
-	a = int(e.get("mmedaddress"),16)
-	s = int(e.get("mmedelementsizebits"))
-	ff = e.get("mmedtypeflags")
-	if ff != None:
-		ff = int(ff,16)
-	else:
-		ff = 0
-	ff = "<" if (ff & 0x02) else ">"
-	######
-	axisinfo = {
-		'x': {'indexcount': xindexcount, 'type': xtype, 'linkobjid': xlinkobjid, 'xot': xot, 'xdp': xdp},# 'xmin': xmin, 'xmax': xmax},
-		'y': {'indexcount': yindexcount, 'type': ytype, 'linkobjid': ylinkobjid, 'yot': yot, 'ydp': ydp},# 'ymin': ymin, 'ymax': ymax},
-		'z': {'eq':eq, 'zot': zot, 'zdp': zdp, 'zmin': zmin, 'zmax': zmax, 'lsb':ff}
-	}
-	return n,a,s,axisinfo
-
 class Table(object):
 
 	def __init__(self, name, address, stride, axisinfo, parent, uniqueid=None, flags=0, categories=[], metainfo=None):
@@ -240,26 +49,22 @@ class XDFModel(dv.PyDataViewModel):
 		self.parent = parent
 		self.foldericon = wx.Icon(os.path.join(self.parent.parent.basepath, "images/folder.png"), wx.BITMAP_TYPE_ANY)
 		self.tableicon = wx.Icon(os.path.join(self.parent.parent.basepath, "images/table.png"), wx.BITMAP_TYPE_ANY)
-		categories = {}
-		for c in xdf.xpath('/XDFFORMAT/XDFHEADER/CATEGORY'):
-			categories[c.get("index")] = c.get("name")
+		categories = xdf["categories"]
 		self.uids = {}
 		self.data = {"0.0.0":Folder("0.0.0","")}
 		cats = []
-		for t in xdf.xpath('/XDFFORMAT/XDFTABLE'):
-			uid = t.get("uniqueid")
-			flags = int(t.get("flags"),16)
+		for t in xdf["tables"]:
+			uid = t["uid"]
+			c0, c1, c2 = t["categories"]
 			parent = ["0","0","0"]
-			c0 = t.xpath('CATEGORYMEM[@index=0]')
-			if len(c0) > 0:
-				parent[0] = c0[0].get("category")
+			if not c0 is None:
+				parent[0] = c0
 				p = ".".join(parent)
 				if not p in self.data:
 					self.data[p] = Folder(p,categories["0x%X" % (int(parent[0])-1)])
 					cats.append(self.data[p].label)
-			c1 = t.xpath('CATEGORYMEM[@index=1]')
-			if len(c1) > 0:
-				parent[1] = c1[0].get("category")
+			if not c1 is None:
+				parent[1] = c1
 				p = ".".join(parent)
 				if not p in self.data:
 					self.data[p] = Folder(p,categories["0x%X" % (int(parent[1])-1)])
@@ -269,9 +74,8 @@ class XDFModel(dv.PyDataViewModel):
 				pp = ".".join(pp)
 				if not self.data[p] in self.data[pp].children:
 					self.data[pp].children.append(self.data[p])
-			c2 = t.xpath('CATEGORYMEM[@index=2]')
-			if len(c2) > 0:
-				parent[2] = c2[0].get("category")
+			if not c2 is None:
+				parent[2] = c2
 				p = ".".join(parent)
 				if not p in self.data:
 					self.data[p] = Folder(p,categories["0x%X" % (int(parent[2])-1)])
@@ -283,8 +87,7 @@ class XDFModel(dv.PyDataViewModel):
 				if not self.data[p] in self.data[pp].children:
 					self.data[pp].children.append(self.data[p])
 			pp = ".".join(parent)
-			n,a,s,i = get_table_info(t)
-			self.data[pp].children.append(Table(n,a,s,i,pp,uniqueid=uid,flags=flags,categories=cats,metainfo=self.parent.metainfo))
+			self.data[pp].children.append(Table(t["title"],t["address"],t["stride"],t["axisinfo"],pp,uniqueid=uid,flags=t["flags"],categories=cats,metainfo=self.parent.metainfo))
 			self.uids[uid] = self.data[pp].children[-1]
 		self.UseWeakRefs(True)
 
@@ -378,6 +181,46 @@ class XDFModel(dv.PyDataViewModel):
 				ret = 0
 		return ret * ascending
 
+def cell_dtype(stride, lsb):
+	return np.dtype("%su%d" % (lsb, 2 if stride == 16 else 1))
+
+def read_cells(buf, node):
+	rows = node.axisinfo['y']['indexcount']
+	cols = node.axisinfo['x']['indexcount']
+	dt = cell_dtype(node.stride, node.axisinfo['z']['lsb'])
+	return np.frombuffer(buf, dtype=dt, count=rows*cols, offset=node.address).astype(int).reshape(rows, cols)
+
+def cell_values(z, raw):
+	if z['eq'] is None:
+		return raw.astype(np.float64)
+	return compile_equation(z['eq'])(raw)
+
+def cell_formatter(z, stride):
+	if z['eq'] is None:
+		return lambda x: "%d" % x
+	elif z['zot'] == "0":
+		fmt = "%04X" if stride == 16 else "%02X"
+		return lambda x: fmt % int(x)
+	elif z['zot'] == "1" and not z['zdp'] is None:
+		dp = int(z['zdp'])
+		return lambda x: "%s" % round(x,dp)
+	return lambda x: "%s" % x
+
+def cell_parser(z):
+	if not z['eq'] is None and z['zot'] == "0":
+		return lambda x: int(x,16)
+	return float
+
+def format_axis(z, raw):
+	values = compile_equation(z['eq'])(raw)
+	if z['zot'] == "0":
+		return np.array([chr(int(x)) for x in values.flatten().tolist()]).reshape(raw.shape)
+	elif z['zot'] == "1":
+		if not z['zdp'] is None:
+			return np.round(values, int(z['zdp']))
+		return values
+	return values.astype(int)
+
 class XDFGridTable(wx.grid.GridTableBase):
 
 	def __init__(self, uids, byts, bin, node):
@@ -392,125 +235,78 @@ class XDFGridTable(wx.grid.GridTableBase):
 		self.restriction = None
 		if self.metainfo["restriction"] != None and self.metainfo["restrictions"] != None:
 			self.restriction = self.metainfo["restrictions"][list(self.metainfo["restrictions"].keys())[0]]
-		rows = self.axisinfo['y']['indexcount']
-		cols = self.axisinfo['x']['indexcount']
-		zzt = self.axisinfo['z']['lsb']
-		s = "B"
-		if self.stride == 16:
-			s = "H"
-		self.origdata = np.array(struct.unpack_from("%s%d%s" % (zzt, rows*cols, s), bin, offset=self.address))
-		self.data = np.array(struct.unpack_from("%s%d%s" % (zzt, rows*cols, s), byts, offset=self.address))
-		if not self.axisinfo['z']['eq'] is None:
-			def formatCell(x):
-				x = nsp.eval(self.axisinfo['z']['eq'].replace("X",str(x)))
-				if self.axisinfo['z']['zot'] == "0":
-					if self.stride == 16:
-						return "%04X" % (x)
-					else:
-						return "%02X" % (x)
-				elif self.axisinfo['z']['zot'] == "1":
-					if not self.axisinfo['z']['zdp'] is None:
-						dp = int(self.axisinfo['z']['zdp'])
-						return "%s" % (round(x,dp))
-					return "%s" % (float(x))
-				elif self.axisinfo['z']['zot'] == "2":
-					return "%s" % (x)
-			self.data = np.vectorize(formatCell)(self.data)
-			self.origdata = np.vectorize(formatCell)(self.origdata)
-		self.data = self.data.reshape(rows, cols)
-		self.origdata = self.origdata.reshape(rows, cols)
+		z = self.axisinfo['z']
+		self.format = cell_formatter(z, self.stride)
+		self.parse = cell_parser(z)
+		self.zrange = None
+		if not z['zmin'] is None and not z['zmax'] is None:
+			self.zrange = [float(z['zmin']), float(z['zmax'])]
+		self.origvalues = cell_values(z, read_cells(bin, node))
+		self.values = cell_values(z, read_cells(byts, node))
+		# colour bucket per cell, attributes are shared per bucket
+		self.heat = None
+		self.attrs = {}
+		if self.flags & 0x30 and not self.zrange is None:
+			self.heat = np.interp(self.values, self.zrange, [0,99]).astype(int)
 
 		self.cols = None
 		if "linkobjid" in self.axisinfo["x"]:
 			x = self.axisinfo["x"]["linkobjid"]
 			if not x is None:
 				xx = uids[x]
-				sx = "B"
-				if xx.stride == 16:
-					sx = "H"
-				xxrows = xx.axisinfo['y']['indexcount']
-				xxcols = xx.axisinfo['x']['indexcount']
-				xxt = xx.axisinfo['z']['lsb']
-				self.cols = np.array(struct.unpack_from("%s%d%s" % (xxt, xxrows*xxcols, sx), byts, offset=xx.address)).reshape(xxrows, xxcols)
+				self.cols = read_cells(byts, xx)
 				if not xx.axisinfo['z']['eq'] is None:
-					def formatCell(x):
-						x = nsp.eval(xx.axisinfo['z']['eq'].replace("X",str(x)))
-						if xx.axisinfo['z']['zot'] == "0":
-							return chr(x)
-						elif xx.axisinfo['z']['zot'] == "1":
-							if not xx.axisinfo['z']['zdp'] is None:
-								return round(x,int(xx.axisinfo['z']['zdp']))
-							return float(x)
-						elif xx.axisinfo['z']['zot'] == "2":
-							return int(x)
-					self.cols = np.vectorize(formatCell)(self.cols)
+					self.cols = format_axis(xx.axisinfo['z'], self.cols)
 		self.rows = None
 		if "linkobjid" in self.axisinfo["y"]:
 			y = self.axisinfo["y"]["linkobjid"]
 			if not y is None:
 				yy = uids[y]
-				sy = "B"
-				if yy.stride == 16:
-					sy = "H"
-				yyrows = yy.axisinfo['y']['indexcount']
-				yycols = yy.axisinfo['x']['indexcount']
-				yyt = yy.axisinfo['z']['lsb']
-				self.rows = np.array(struct.unpack_from("%s%d%s" % (yyt, yyrows*yycols, sy), byts, offset=yy.address)).reshape(yyrows, yycols)
+				self.rows = read_cells(byts, yy)
 				if not yy.axisinfo['z']['eq'] is None:
-					def formatCell(y):
-						y = nsp.eval(yy.axisinfo['z']['eq'].replace("X",str(y)))
-						if yy.axisinfo['z']['zot'] == "0":
-							return chr(y)
-						elif yy.axisinfo['z']['zot'] == "1":
-							if not yy.axisinfo['z']['zdp'] is None:
-								return round(y,int(yy.axisinfo['z']['zdp']))
-							return float(y)
-						elif yy.axisinfo['z']['zot'] == "2":
-							return int(y)
-					self.rows = np.vectorize(formatCell)(self.rows)
+					self.rows = format_axis(yy.axisinfo['z'], self.rows)
 
 	def PackData(self, byts):
-		d = self.data.flatten()
-		if not self.axisinfo['z']['eq'] is None:
-			eq = self.axisinfo['z']['eq'].replace("/","|").replace("*","/").replace("|","*").replace("-","|").replace("+","-").replace("|","+")
-			def formatCell(x):
-				if self.axisinfo['z']['zot'] == "0":
-					x = ord(x)
-				return int(np.ceil(nsp.eval(eq.replace("X",str(x)))))
-			d = np.vectorize(formatCell)(d)
-		s = "B"
-		if self.stride == 16:
-			s = "H"
-		struct.pack_into("%s%d%s" % (self.lsb, self.axisinfo['y']['indexcount']*self.axisinfo['x']['indexcount'], s), byts, self.address, *d)
+		z = self.axisinfo['z']
+		dt = cell_dtype(self.stride, z['lsb'])
+		hi = np.iinfo(dt).max
+		d = self.values.flatten()
+		if not z['eq'] is None:
+			d = inverse_equation(z['eq'], 0, hi)(d)
+		d = np.clip(np.round(d), 0, hi).astype(dt)
+		byts[self.address:self.address+d.nbytes] = d.tobytes()
 
 	def GetNumberRows(self):
-		return self.data.shape[0]
+		return self.values.shape[0]
 
 	def GetNumberCols(self):
-		return self.data.shape[1]
+		return self.values.shape[1]
 
 	def IsEmptyCell(self, row, col):
 		return False
 
 	def SetValue(self, row, col, value):
-		if self.restriction is None:
-			self.dirty = True
-			self.data[row][col] = value
-		else:
-			od = float(self.origdata[row][col])
-			delta = float(value) - od
+		try:
+			value = self.parse(value)
+		except ValueError:
+			return
+		if not self.restriction is None:
+			od = self.origvalues[row, col]
+			delta = value - od
 			if delta < 0:
 				if delta < self.restriction[0]:
 					delta = self.restriction[0]
 			elif delta > 0:
 				if delta > self.restriction[1]:
 					delta = self.restriction[1]
-			nd = "%s" % (float(od+delta))
-			self.data[row][col] = nd
-			self.dirty = True
+			value = od + delta
+		self.values[row, col] = value
+		if not self.heat is None:
+			self.heat[row, col] = int(np.interp(value, self.zrange, [0,99]))
+		self.dirty = True
 
 	def GetValue(self, row, col):
-		return self.data[row][col]
+		return self.format(float(self.values[row, col]))
 
 	def GetTypeName(self, row, col):
 		return wx.grid.GRID_VALUE_STRING
@@ -526,9 +322,14 @@ class XDFGridTable(wx.grid.GridTableBase):
 		return str(row)
 
 	def GetAttr(self, row, col, kind):
-		attr = wx.grid.GridCellAttr()
-		if self.flags & 0x30 and not self.axisinfo['z']['zmin'] is None and not self.axisinfo['z']['zmax'] is None:
-			attr.SetBackgroundColour(colors[int(np.interp(self.data[row][col],[self.axisinfo['z']['zmin'],self.axisinfo['z']['zmax']],[0,99]))])
+		if self.heat is None:
+			return None
+		b = int(self.heat[row, col])
+		if not b in self.attrs:
+			self.attrs[b] = wx.grid.GridCellAttr()
+			self.attrs[b].SetBackgroundColour(colors[b])
+		attr = self.attrs[b]
+		attr.IncRef()
 		return attr
 
 class MyGrid(wx.grid.Grid):
@@ -716,7 +517,7 @@ class TunePanel(wx.Frame):
 		if self.byts == None:
 			self.byts = bytearray()
 			self.byts[:] = self.bin
-		xdftree = etree.fromstring(self.xdf)
+		xdfindex = XDFIndexCache().load(self.xdf)
 
 		self.menubar = wx.MenuBar()
 		self.SetMenuBar(self.menubar)
@@ -740,7 +541,7 @@ class TunePanel(wx.Frame):
 		self.ptreep = wx.Panel(self)
 		ptreesizer = wx.BoxSizer(wx.VERTICAL)
 		self.ptree = wx.dataview.DataViewCtrl(self.ptreep, style=dv.DV_NO_HEADER)
-		self.ptreemodel = XDFModel(self, xdftree)
+		self.ptreemodel = XDFModel(self, xdfindex)
 		self.ptree.AssociateModel(self.ptreemodel)
 		self.c0 = self.ptree.AppendIconTextColumn("Parameter Tree",0)
 		self.c0.SetSortOrder(True)
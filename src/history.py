@@ -0,0 +1,72 @@
+import numpy as np
+
+HISTORY_SIZE = 36000
+
+class RingBuffer(object):
+
+	def __init__(self, channels, capacity=HISTORY_SIZE):
+		self.capacity = capacity
+		self.times = np.zeros(capacity, dtype=np.float64)
+		self.values = np.zeros((capacity, channels), dtype=np.float32)
+		self.pos = 0
+		self.count = 0
+
+	def __len__(self):
+		return self.count
+
+	def append(self, t, values):
+		self.times[self.pos] = t
+		self.values[self.pos] = values
+		self.pos = (self.pos + 1) % self.capacity
+		self.count = min(self.count + 1, self.capacity)
+
+	def clear(self):
+		self.pos = 0
+		self.count = 0
+
+	def segments(self):
+		if self.count < self.capacity:
+			return [(0, self.count)]
+		return [(self.pos, self.capacity), (0, self.pos)]
+
+	def since(self, start, column):
+		times = []
+		values = []
+		for a, b in self.segments():
+			i = a + np.searchsorted(self.times[a:b], start)
+			times.append(self.times[i:b])
+			values.append(self.values[i:b, column])
+		return np.concatenate(times), np.concatenate(values)
+
+	def last(self):
+		if self.count == 0:
+			return None
+		return self.times[self.pos - 1]
+
+	def minmax(self, column, start, end, width):
+		t, v = self.since(start, column)
+		if len(t) == 0 or end <= start or width <= 0:
+			return np.zeros(0, dtype=int), np.zeros(0), np.zeros(0)
+		x = np.clip(((t - start) / (end - start) * width).astype(int), 0, width - 1)
+		b = np.flatnonzero(np.r_[True, x[1:] != x[:-1]])
+		return x[b], np.minimum.reduceat(v, b), np.maximum.reduceat(v, b)
+
+class TableHistory(object):
+
+	def __init__(self, capacity=HISTORY_SIZE):
+		self.capacity = capacity
+		self.buffers = {}
+
+	def add(self, frame):
+		if frame.values is None:
+			return
+		if not frame.table in self.buffers:
+			self.buffers[frame.table] = RingBuffer(len(frame.values), self.capacity)
+		self.buffers[frame.table].append(frame.time, frame.values)
+
+	def get(self, table):
+		return self.buffers.get(table, None)
+
+	def clear(self):
+		for b in self.buffers.values():
+			b.clear()
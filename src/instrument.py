@@ -0,0 +1,96 @@
+import json
+import time
+from threading import Lock
+
+# upper bounds in ms, last bucket catches everything slower
+LATENCY_BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000]
+# how many data bytes identify a command (password bytes must not end up in keys)
+KEY_BYTES = {0x27: 1, 0x82: 0}
+
+def command_key(mtype, data):
+	n = KEY_BYTES.get(mtype[0], 2)
+	key = "".join(["%02x" % b for b in mtype])
+	if n > 0 and len(data) > 0:
+		key += ":" + "".join(["%02x" % b for b in data[:n]])
+	return key
+
+def bucket(ms):
+	for i, b in enumerate(LATENCY_BUCKETS):
+		if ms <= b:
+			return i
+	return len(LATENCY_BUCKETS)
+
+class CommandStats(object):
+
+	def __init__(self, samples=False):
+		self.lock = Lock()
+		self.keep = samples
+		self.reset()
+
+	def reset(self):
+		with self.lock:
+			self.commands = {}
+			self.samples = []
+			self.start = time.time()
+
+	def record(self, key, latency, attempts, ok):
+		ms = latency * 1000.0
+		with self.lock:
+			if self.keep:
+				self.samples.append(ms)
+			if not key in self.commands:
+				self.commands[key] = {
+					"count": 0, "failed": 0, "retries": 0,
+					"total": 0.0, "min": None, "max": 0.0, "last": None,
+					"latency": [0] * (len(LATENCY_BUCKETS)+1),
+					"jitter": [0] * (len(LATENCY_BUCKETS)+1),
+				}
+			c = self.commands[key]
+			c["count"] += 1
+			c["retries"] += max(0, attempts-1)
+			if not ok:
+				c["failed"] += 1
+			c["total"] += ms
+			c["min"] = ms if c["min"] is None else min(c["min"], ms)
+			c["max"] = max(c["max"], ms)
+			c["latency"][bucket(ms)] += 1
+			if c["last"] is not None:
+				c["jitter"][bucket(abs(ms - c["last"]))] += 1
+			c["last"] = ms
+
+	def snapshot(self):
+		with self.lock:
+			commands = {}
+			for k, c in self.commands.items():
+				commands[k] = dict(c, latency=list(c["latency"]), jitter=list(c["jitter"]), mean=c["total"]/c["count"])
+			return {"start":self.start, "elapsed":time.time()-self.start, "buckets":LATENCY_BUCKETS, "commands":commands}
+
+	def summary(self):
+		snap = self.snapshot()
+		lines = ["%-12s %7s %6s %7s %8s %8s %8s" % ("command", "count", "fail", "retry", "min ms", "mean ms", "max ms")]
+		for k in sorted(snap["commands"]):
+			c = snap["commands"][k]
+			lines.append("%-12s %7d %6d %7d %8.2f %8.2f %8.2f" % (k, c["count"], c["failed"], c["retries"], c["min"], c["mean"], c["max"]))
+		return lines
+
+def export_stats(path, stats):
+	with open(path, "w") as f:
+		json.dump(dict((k, s.snapshot()) for k, s in stats.items()), f, indent=1, sort_keys=True)
+
+def instrument(ecu, stats):
+	send_command = ecu.send_command
+	attempts = [0]
+	if hasattr(ecu, "send"):
+		send = ecu.send
+		def counted_send(*args, **kwargs):
+			attempts[0] += 1
+			return send(*args, **kwargs)
+		ecu.send = counted_send
+	def timed_send_command(mtype, data=[], *args, **kwargs):
+		attempts[0] = 0
+		t = time.perf_counter()
+		ret = send_command(mtype, data, *args, **kwargs)
+		stats.record(command_key(mtype, data), time.perf_counter() - t, attempts[0], ret is not None)
+		return ret
+	ecu.send_command = timed_send_command
+	return ecu
@@ -0,0 +1,91 @@
+import time
+
+from tables import MAIN_TABLES
+
+# target Hz (0 = as fast as the bus allows) and priority (lower first)
+TABLE_RATES = dict((t, (0, 0)) for t in MAIN_TABLES)
+TABLE_RATES.update({
+	0x20: (2.0, 1),
+	0x21: (2.0, 1),
+	0xd0: (1.0, 2),
+	0xd1: (1.0, 2),
+})
+DEFAULT_RATE = (1.0, 3)
+UPDATE_SLICE = .5
+
+class TableScheduler(object):
+
+	def __init__(self, tables, rates=None):
+		if rates is None:
+			rates = {}
+		now = time.time()
+		self.entries = {}
+		for t in tables:
+			rate, priority = rates.get(t, TABLE_RATES.get(t, DEFAULT_RATE))
+			self.entries[t] = {"rate":rate, "priority":priority, "due":now, "count":0, "start":now}
+
+	def next(self, now=None):
+		if now is None:
+			now = time.time()
+		due = [(e["priority"], e["due"], t) for t, e in self.entries.items() if e["rate"] > 0 and e["due"] <= now]
+		if due:
+			return min(due)[2], 0
+		free = [(e["priority"], e["count"], t) for t, e in self.entries.items() if e["rate"] <= 0]
+		if free:
+			return min(free)[2], 0
+		if not self.entries:
+			return None, UPDATE_SLICE
+		return None, min([e["due"] for e in self.entries.values()]) - now
+
+	def served(self, t, now=None):
+		if now is None:
+			now = time.time()
+		e = self.entries[t]
+		e["count"] += 1
+		if e["rate"] > 0:
+			e["due"] = max(e["due"] + 1.0/e["rate"], now)
+
+	def rates(self, now=None):
+		if now is None:
+			now = time.time()
+		return dict((t, e["count"]/(now - e["start"]) if now > e["start"] else 0) for t, e in self.entries.items())
+
+DTC_TYPES = [0x74, 0x73]
+DTC_SLOTS = range(1, 0x0c)
+DTC_INTERVAL = 2.0
+DTC_STEP = .1
+
+class DTCScanner(object):
+
+	def __init__(self, interval=DTC_INTERVAL, step=DTC_STEP):
+		self.interval = interval
+		self.step = step
+		self.restart()
+
+	def restart(self):
+		self.due = 0
+		self.pending = []
+		self.codes = {}
+
+	def next(self, now=None):
+		if now is None:
+			now = time.time()
+		if now < self.due:
+			return None
+		if not self.pending:
+			self.pending = [(t, i) for t in DTC_TYPES for i in DTC_SLOTS]
+			self.codes = dict((hex(t), []) for t in DTC_TYPES)
+		return self.pending[0]
+
+	def result(self, req, codes, now=None):
+		if now is None:
+			now = time.time()
+		self.pending.remove(req)
+		self.codes[hex(req[0])] += codes
+		if len(codes) == 0:
+			self.pending = [p for p in self.pending if p[0] != req[0]]
+		if self.pending:
+			self.due = now + self.step
+			return None
+		self.due = now + self.interval
+		return self.codes
@@ -0,0 +1,58 @@
+import os
+import json
+import tempfile
+from threading import Lock
+
+from ecmids import ECM_IDs
+
+def ecu_key(ecmid):
+	if not ecmid:
+		return None
+	ecmid = bytes(ecmid)
+	if ecmid in ECM_IDs:
+		return ECM_IDs[ecmid]["pn"]
+	return "".join(["%02x" % i for i in ecmid])
+
+class ECUProfiles(object):
+
+	def __init__(self, path=None):
+		if path is None:
+			path = os.path.join(os.path.expanduser("~"), ".hondaecu", "profiles.json")
+		self.path = path
+		self.lock = Lock()
+		self.profiles = self.load()
+
+	def load(self):
+		try:
+			with open(self.path, "r") as f:
+				return json.load(f)
+		except (IOError, ValueError):
+			return {}
+
+	def get(self, key):
+		with self.lock:
+			return dict(self.profiles.get(key, {}))
+
+	def update(self, key, **kwargs):
+		if key is None:
+			return
+		with self.lock:
+			# merge with what is on disk so other writers' keys survive
+			profiles = self.load()
+			for k, v in self.profiles.items():
+				if not k in profiles:
+					profiles[k] = v
+			if not key in profiles:
+				profiles[key] = {}
+			profiles[key].update(kwargs)
+			self.profiles = profiles
+			try:
+				d = os.path.dirname(self.path)
+				if not os.path.isdir(d):
+					os.makedirs(d)
+				fd, tmp = tempfile.mkstemp(dir=d, prefix=".profiles", suffix=".tmp")
+				with os.fdopen(fd, "w") as f:
+					json.dump(profiles, f, indent=1, sort_keys=True)
+				os.replace(tmp, self.path)
+			except (IOError, OSError):
+				pass
@@ -0,0 +1,285 @@
+import os
+import time
+import random
+import struct
+from collections import deque
+from threading import Lock
+
+from ecmids import ECM_IDs
+from transfer import DEFAULT_PASSWORD
+
+SIM_TABLES = {
+	0x10: 17,
+	0x11: 20,
+	0x13: 17,
+	0x17: 19,
+}
+
+def sim_checksum(msg):
+	return (-sum(msg)) & 0xFF
+
+def sim_frame(mtype, data):
+	msg = list(mtype) + [len(mtype) + len(data) + 2] + list(data)
+	return bytes(msg + [sim_checksum(msg)])
+
+class SimulatedECU(object):
+
+	def __init__(self, binfile=None, ecmid=None, flashcount=0, dtcs=None, password=DEFAULT_PASSWORD, erasetime=6.0, writetime=.01):
+		self.image = bytearray(b"\xff" * 0x40000)
+		if binfile:
+			with open(binfile, "rb") as fbin:
+				self.image = bytearray(fbin.read())
+		if ecmid is None:
+			ecmid = b"\x00\x00\x00\x00\x00"
+			if binfile:
+				pn = os.path.splitext(os.path.basename(binfile))[0]
+				for k, v in ECM_IDs.items():
+					if v["pn"] == pn:
+						ecmid = k
+						break
+		self.ecmid = bytes(ecmid)
+		self.flashcount = flashcount
+		self.dtcs = dtcs if dtcs is not None else {0x73: [], 0x74: []}
+		self.password = list(password)
+		self.erasetime = erasetime
+		self.writetime = writetime
+		self.powered = True
+		self.state = "ok"
+		self.passok = 0
+		self.erasestart = None
+		self.busy = 0
+		self.start = time.time()
+		self.handlers = {
+			(0xfe,): self.handle_wakeup,
+			(0x72,): self.handle_diag,
+			(0x7d,): self.handle_flashcount,
+			(0x27,): self.handle_password,
+			(0x7b,): self.handle_recover,
+			(0x7e,): self.handle_write,
+			(0x82, 0x82, 0x00): self.handle_read,
+		}
+
+	def power(self, on):
+		self.powered = on
+		if on:
+			self.state = "read" if self.passok == 2 else ("write" if self.state in ["write", "recover"] else "ok")
+		self.passok = 0
+
+	def table(self, t):
+		if t not in SIM_TABLES:
+			return []
+		now = time.time() - self.start
+		data = bytearray(SIM_TABLES[t])
+		struct.pack_into(">H", data, 0, int(1200 + 800 * ((now * 10) % 10)))
+		for i in range(2, len(data)):
+			data[i] = int(now * (i + 1)) & 0xFF
+		return list(data)
+
+	def handle_wakeup(self, data):
+		if self.state == "ok":
+			return [0x72]
+
+	def handle_diag(self, data):
+		if self.state != "ok":
+			return None
+		if data[0] == 0x00:
+			return data[:2]
+		elif data[0] == 0x71:
+			if data[1] == 0x00:
+				return [0x71, 0x00] + list(self.ecmid) + [0x00] * 10
+			return [0x71, data[1]] + self.table(data[1])
+		elif data[0] in self.dtcs:
+			codes = self.dtcs[data[0]][(data[1]-1)*3:data[1]*3]
+			body = [0x00] * 6
+			for j, c in enumerate(codes):
+				body[j*2:j*2+2] = c
+			return [data[0], data[1], 0x00] + body
+		elif data[0] == 0x60:
+			for k in self.dtcs:
+				self.dtcs[k] = []
+			return [0x60, 0x00]
+		return data[:2]
+
+	def handle_flashcount(self, data):
+		if self.state not in ["ok", "write"]:
+			return None
+		if data[1] == 0x01 and data[2] == 0x03:
+			return [0x01, 0x01, 0x03, 0x00, self.flashcount & 0xFF]
+		if data[1] in [0x02, 0x03]:
+			self.state = "write"
+		return data[:3]
+
+	def handle_password(self, data):
+		if self.state != "ok":
+			return None
+		if data[0] == 0xe0:
+			half = self.password[:7] if self.passok == 0 else self.password[7:]
+			if data[1:] == half:
+				self.passok += 1
+				if self.passok == 2:
+					self.state = "read"
+			else:
+				self.passok = 0
+			return [0xe0, 0x00]
+		return data[:2]
+
+	def handle_recover(self, data):
+		self.state = "recover"
+		return data[:2]
+
+	def handle_read(self, data):
+		if self.state != "read":
+			return None
+		location = (data[0] << 16) | (data[2] << 8) | data[1]
+		if location >= len(self.image):
+			return None
+		return list(self.image[location:location+data[3]])
+
+	def handle_write(self, data):
+		if self.state not in ["write", "recover"]:
+			return None
+		now = time.time()
+		if now < self.busy:
+			return None
+		sub = data[1]
+		if sub == 0x04:
+			self.erasestart = now
+			self.image[:] = b"\xff" * len(self.image)
+		elif sub == 0x05:
+			if self.erasestart is None:
+				return [0x01, 0xfa]
+			if now - self.erasestart < self.erasetime:
+				return [0x01, 0x01]
+			return [0x01, 0x00]
+		elif sub == 0x06:
+			x = data[2:-2]
+			if sim_checksum(x) != data[-1]:
+				return None
+			location = struct.unpack(">H", bytes(x[:2]))[0] * 16
+			block = x[2:-2]
+			self.image[location:location+len(block)] = bytes(block)
+			self.busy = now + self.writetime
+			return [0x01, 0x06]
+		elif sub == 0x09:
+			self.flashcount += 1
+		return [0x01, sub, 0x00]
+
+	def handle(self, mtype, data):
+		if not self.powered:
+			return None
+		handler = self.handlers.get(tuple(mtype), None)
+		if handler is None:
+			return None
+		reply = handler(data)
+		if reply is None:
+			return None
+		if len(mtype) == 3:
+			rmtype = [mtype[0] | 0x10, mtype[1] | 0x10, mtype[2]]
+		else:
+			rmtype = [mtype[0] & 0x0f]
+		return sim_frame(rmtype, reply)
+
+class SimulatedFtdiFn(object):
+
+	def __init__(self, adapter):
+		self.adapter = adapter
+
+	def ftdi_set_bitmode(self, mask, mode):
+		self.adapter.bitbang = mode != 0
+
+	def __getattr__(self, name):
+		return lambda *args: 0
+
+class SimulatedKlineAdapter(object):
+
+	def __init__(self, binfile=None, device_id=None, baudrate=10400, latency=.005, error_rate=0.0, corrupt_rate=0.0, ecu=None, seed=None):
+		self.device_id = device_id
+		self.baudrate = baudrate
+		self.latency = latency
+		self.error_rate = error_rate
+		self.corrupt_rate = corrupt_rate
+		self.ecu = ecu if ecu is not None else SimulatedECU(binfile)
+		self.ftdi_fn = SimulatedFtdiFn(self)
+		self.bitbang = False
+		self.random = random.Random(seed)
+		self.lock = Lock()
+		self.rx = deque()
+		self.frame = bytearray()
+		self.wire = 0
+		self.stats = {"written":0, "read":0, "frames":0, "dropped":0, "corrupted":0}
+
+	def bytetime(self):
+		if not self.baudrate:
+			return 0
+		return 10.0 / self.baudrate
+
+	def queue(self, data, start):
+		bt = self.bytetime()
+		for i, b in enumerate(data):
+			self.rx.append((start + (i+1)*bt, b))
+		return start + len(data)*bt
+
+	def frame_length(self):
+		ml = 3 if self.frame[0] == 0x82 else 1
+		if len(self.frame) <= ml:
+			return ml, None
+		return ml, self.frame[ml]
+
+	def _write(self, data):
+		with self.lock:
+			if self.bitbang:
+				return len(data)
+			now = max(time.time(), self.wire)
+			self.wire = self.queue(data, now)
+			self.stats["written"] += len(data)
+			if not self.ecu.powered:
+				return len(data)
+			self.frame.extend(data)
+			while len(self.frame) > 0:
+				ml, length = self.frame_length()
+				if length is None or len(self.frame) < length:
+					break
+				msg = bytes(self.frame[:length])
+				del self.frame[:length]
+				if length < ml + 2 or sum(msg) & 0xFF != 0:
+					self.frame.clear()
+					break
+				self.stats["frames"] += 1
+				reply = self.ecu.handle(msg[:ml], list(msg[ml+1:-1]))
+				if reply is None:
+					continue
+				if self.random.random() < self.error_rate:
+					self.stats["dropped"] += 1
+					continue
+				if self.random.random() < self.corrupt_rate:
+					self.stats["corrupted"] += 1
+					reply = bytearray(reply)
+					reply[self.random.randrange(len(reply))] ^= 0x5a
+				self.wire = self.queue(reply, self.wire + self.latency)
+			return len(data)
+
+	def _read(self, n):
+		with self.lock:
+			now = time.time()
+			buf = bytearray()
+			while self.rx and len(buf) < n and self.rx[0][0] <= now:
+				buf.append(self.rx.popleft()[1])
+			self.stats["read"] += len(buf)
+			return bytes(buf)
+
+	def flush(self):
+		with self.lock:
+			self.rx.clear()
+			self.frame.clear()
+
+	def kline(self):
+		return self.ecu.powered
+
+	def power(self, on):
+		with self.lock:
+			self.ecu.power(on)
+			self.rx.clear()
+			self.frame.clear()
+
+	def close(self):
+		pass
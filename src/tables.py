@@ -0,0 +1,125 @@
+import time
+import struct
+import numpy as np
+from collections import namedtuple
+
+DTYPES = {"B": "u1", "b": "i1", "H": ">u2", "h": ">i2"}
+
+# name, struct code, unit, scale, offset, display digits (None = raw integer)
+MAIN_FIELDS = [
+	("engine_speed", "H", "rpm", 1, 0, None),
+	("tps_sensor_voltage", "B", "V", 5.0/0xff, 0, 2),
+	("tps_sensor_scantool", "B", "%", 1/1.6, 0, 2),
+	("ect_sensor_voltage", "B", "V", 5.0/0xff, 0, 2),
+	("ect_sensor_scantool", "B", "°C", 1, -40, None),
+	("iat_sensor_voltage", "B", "V", 5.0/0xff, 0, 2),
+	("iat_sensor_scantool", "B", "°C", 1, -40, None),
+	("map_sensor_voltage", "B", "V", 5.0/0xff, 0, 2),
+	("map_sensor_scantool", "B", "kPa", 1, 0, None),
+]
+TAIL_FIELDS = [
+	("battery_voltage", "B", "V", 1/10.0, 0, 2),
+	("vehicle_speed", "B", "Km/h", 1, 0, None),
+	("injector_duration", "H", "ms", 265.5/0xffff, 0, 2),
+	("ignition_advance", "B", "°", 127.5/0xff, -64, 2),
+]
+SHORT_TAIL_FIELDS = [(n, "B", u, s, o, d) for n, c, u, s, o, d in TAIL_FIELDS]
+IACV_FIELDS = [
+	("iacv_pulse_count", "B", "", 1, 0, None),
+	("iacv_command", "H", "", 8.0/0xffff, 0, 4),
+]
+UNKNOWN_FIELDS = [
+	("unknown_9", "B", "", 1, 0, None),
+	("unknown_10", "B", "", 1, 0, None),
+]
+O2_FIELDS = [
+	("o2_sensor_voltage", "B", "V", 5.0/0xff, 0, 2),
+	("stft", "B", "", 2.0/0xff, 0, 4),
+	("o2_heater_voltage", "B", "V", 5.0/0xff, 0, 2),
+]
+EGCV_FIELDS = [
+	("unknown_0", "B", "", 1, 0, None),
+	("unknown_1", "B", "", 1, 0, None),
+	("unknown_2", "B", "", 1, 0, None),
+	("unknown_3", "B", "", 1, 0, None),
+	("unknown_4", "B", "", 1, 0, None),
+	("egcv_current", "B", "V", 5.0/0xff, 0, 3),
+	("egcv_target", "B", "V", 5.0/0xff, 0, 3),
+	("egcv_load", "b", "%", 1, 0, None),
+	("hesd_current", "B", "A", 5.0/0xff, 0, 3),
+	("hesd_target", "B", "A", 5.0/0xff, 0, 3),
+	("hesd_load", "B", "%", 1, 0, None),
+]
+
+class TableLayout(object):
+
+	def __init__(self, table, fields):
+		self.table = table
+		self.fields = fields
+		self.names = [f[0] for f in fields]
+		self.units = [f[2] for f in fields]
+		self.digits = [f[5] for f in fields]
+		self.index = dict((n, i) for i, n in enumerate(self.names))
+		self.visible = [i for i, n in enumerate(self.names) if not n.startswith("unknown")]
+		self.struct = struct.Struct(">" + "".join([f[1] for f in fields]))
+		self.size = self.struct.size
+		self.dtype = np.dtype([(f[0], DTYPES[f[1]]) for f in fields])
+		self.scale = np.array([f[3] for f in fields], dtype=np.float64)
+		self.offset = np.array([f[4] for f in fields], dtype=np.float64)
+		self.scaled = [i for i, f in enumerate(fields) if f[3] != 1 or f[4] != 0]
+
+	def decode(self, payload):
+		data = list(self.struct.unpack_from(payload))
+		for i in self.scaled:
+			data[i] = data[i]*self.fields[i][3] + self.fields[i][4]
+		return data
+
+	def display(self, data):
+		return [v if d is None else round(v, d) for v, d in zip(data, self.digits)]
+
+	def decode_many(self, payloads):
+		if not isinstance(payloads, np.ndarray):
+			payloads = np.frombuffer(b"".join([bytes(p[:self.size]) for p in payloads]), dtype=np.uint8).reshape(-1, self.size)
+		raw = np.ascontiguousarray(payloads[:, :self.size]).view(self.dtype).reshape(-1)
+		values = np.empty((len(raw), len(self.names)), dtype=np.float64)
+		for i, n in enumerate(self.names):
+			values[:, i] = raw[n]
+		return values*self.scale + self.offset
+
+TABLES = {}
+MAIN_TABLES = [0x10, 0x11, 0x13, 0x17]
+
+def register(layout):
+	TABLES[layout.table] = layout
+	return layout
+
+def get_layout(table):
+	return TABLES.get(table, None)
+
+class DecodedFrame(namedtuple("DecodedFrame", ["table", "time", "raw", "values"])):
+	__slots__ = ()
+
+	@property
+	def layout(self):
+		return get_layout(self.table)
+
+	def value(self, name):
+		return self.values[self.layout.index[name]]
+
+def decode_frame(table, payload, t=None):
+	if t is None:
+		t = time.time()
+	layout = get_layout(table)
+	values = None
+	if layout is not None and len(payload) >= layout.size:
+		values = tuple(layout.decode(payload))
+	return DecodedFrame(table, t, bytes(payload), values)
+
+register(TableLayout(0x10, MAIN_FIELDS + UNKNOWN_FIELDS + TAIL_FIELDS))
+register(TableLayout(0x11, MAIN_FIELDS + UNKNOWN_FIELDS + TAIL_FIELDS + IACV_FIELDS))
+# 0x13 and 0x17 have no unknown_9/10 bytes and carry the tail as single bytes
+register(TableLayout(0x13, MAIN_FIELDS + SHORT_TAIL_FIELDS))
+register(TableLayout(0x17, MAIN_FIELDS + SHORT_TAIL_FIELDS + [("unknown_15", "H", "", 1, 0, None), ("unknown_16", "B", "", 1, 0, None), ("unknown_17", "B", "", 1, 0, None), ("unknown_18", "B", "", 1, 0, None)]))
+register(TableLayout(0x20, O2_FIELDS))
+register(TableLayout(0x21, O2_FIELDS))
+register(TableLayout(0xd0, EGCV_FIELDS))
@@ -1,20 +1,49 @@
 import time
-import os
-import wx
-from threading import Thread
+import heapq
+import itertools
+from threading import Thread, Condition
 from pydispatch import dispatcher
 from pylibftdi import Driver, FtdiError, LibraryMissingError
-import numpy as np
 
 from eculib import KlineAdapter
 from eculib.honda import *
 
+from transfer import READ_RETRIES, READ_ALIGN, ReadBlockSizer, ReadBuffer, WritePacer, EraseTiming, ProgressReporter, write_plan, ERASE_SETTLE
+from polling import TableScheduler, DTCScanner, UPDATE_SLICE, DTC_INTERVAL
+from profiles import ECUProfiles, ecu_key
+from instrument import CommandStats, instrument
+from tables import decode_frame
+from ecmids import ECM_IDs
+
+COMMAND_PRIORITY = {
+	"read": 0,
+	"write": 0,
+	"dtc.clear": 1,
+	"hrc": 1,
+	"dtc.on": 2,
+	"dtc.off": 2,
+	"data.on": 2,
+	"data.off": 2,
+}
+IDLE_WAIT = 1.0
+OFF_WAIT = .25
+# clean 64 byte flashes before 128 byte blocks are tried again
+WRITESIZE_RETRY = 5
+
 class KlineWorker(Thread):
 
-	def __init__(self, parent):
+	def __init__(self, parent, serial, post=None, adapter=KlineAdapter, profiles=None):
 		self.parent = parent
+		self.serial = serial
+		self.post = post
+		self.adapter = adapter
+		self.running = True
+		self.profiles = ECUProfiles() if profiles is None else profiles
+		self.stats = CommandStats()
+		self.commands = []
+		self.sequence = itertools.count()
+		self.wakeup = Condition()
 		self.__clear_data()
-		dispatcher.connect(self.DeviceHandler, signal="FTDIDevice", sender=dispatcher.Any)
 		dispatcher.connect(self.ErrorPanelHandler, signal="ErrorPanel", sender=dispatcher.Any)
 		dispatcher.connect(self.DatalogPanelHandler, signal="DatalogPanel", sender=dispatcher.Any)
 		dispatcher.connect(self.ReadPanelHandler, signal="ReadPanel", sender=dispatcher.Any)
@@ -22,12 +51,6 @@ class KlineWorker(Thread):
 		dispatcher.connect(self.HRCSettingsPanelHandler, signal="HRCSettingsPanel", sender=dispatcher.Any)
 		Thread.__init__(self)
 
-	def __cleanup(self):
-		if self.ecu:
-			self.ecu.dev.close()
-			del self.ecu
-		self.__clear_data()
-
 	def __clear_data(self):
 		self.ecu = None
 		self.ready = False
@@ -46,106 +69,173 @@ class KlineWorker(Thread):
 		self.errorcodes = {}
 		self.update_errors = False
 		self.clear_codes = False
+		self.dtcscanner = DTCScanner()
 		self.flashcount = -1
 		self.dtccount = -1
 		self.update_tables = False
 		self.tables = None
-		wx.CallAfter(dispatcher.send, signal="KlineWorker", sender=self, info="ecmid", value=bytes(self.ecmid))
-		wx.CallAfter(dispatcher.send, signal="KlineWorker", sender=self, info="flashcount", value=self.flashcount)
-
-	def HRCSettingsPanelHandler(self, mode, data):
-		self.hrcmode = (mode, data)
-
-	def WritePanelHandler(self, data, offset):
-		self.writeinfo = [data,offset,None]
-
-	def ReadPanelHandler(self, data, offset, passwd):
-		if self.state != ECUSTATE.READ:
-			self.sendpassword = True
-		self.readinfo = [data,offset,None, passwd]
-
-	def DatalogPanelHandler(self, action):
-		if action == "data.on":
-			self.update_tables = True
-		elif action == "data.off":
-			self.update_tables = False
-
-	def ErrorPanelHandler(self, action):
-		if action == "dtc.clear":
-			self.clear_codes = True
-		elif action == "dtc.on":
-			self.update_errors = True
-		elif action == "dtc.off":
-			self.update_errors = False
-
-	def DeviceHandler(self, action, vendor, product, serial):
-		if action == "interrupt":
-			raise Exception()
-		elif action == "deactivate":
-			if self.ecu:
-				self.__cleanup()
-		elif action == "activate":
-			self.__clear_data()
-			try:
-				self.ecu = HondaECU(KlineAdapter(device_id=serial))
-				self.ready = True
-			except FtdiError:
-				pass
+		self.scheduler = None
+		self.notify("ecmid", bytes(self.ecmid))
+		self.notify("flashcount", self.flashcount)
+
+	def notify(self, info, value):
+		if self.post is None:
+			dispatcher.send(signal="KlineWorker", sender=self, info=info, value=value, serial=self.serial)
+		else:
+			self.post(dispatcher.send, signal="KlineWorker", sender=self, info=info, value=value, serial=self.serial)
+
+	def routed(self, serial):
+		if serial is None:
+			serial = self.parent.active_ftdi_device
+		return serial == self.serial
+
+	def stop(self):
+		with self.wakeup:
+			self.running = False
+			# makes running transfers return, a read keeps its checkpoint
+			self.readinfo = None
+			self.writeinfo = None
+			self.wakeup.notify()
+
+	def submit(self, command, *args):
+		with self.wakeup:
+			heapq.heappush(self.commands, (COMMAND_PRIORITY[command], next(self.sequence), command, args))
+			self.wakeup.notify()
+
+	def pending(self):
+		with self.wakeup:
+			return len(self.commands) > 0
+
+	def wait(self, timeout):
+		with self.wakeup:
+			if self.running and not self.commands:
+				self.wakeup.wait(timeout)
+
+	def process_commands(self):
+		while True:
+			with self.wakeup:
+				if not self.commands:
+					return
+				command, args = heapq.heappop(self.commands)[2:]
+			if command == "read":
+				if self.state != ECUSTATE.READ:
+					self.sendpassword = True
+				self.readinfo = [args[0],args[1],None,args[2]]
+			elif command == "write":
+				self.writeinfo = [args[0],args[1],None,args[2]]
+			elif command == "hrc":
+				self.hrcmode = args
+			elif command == "dtc.clear":
+				self.clear_codes = True
+			elif command == "dtc.on":
+				self.dtcscanner.restart()
+				self.update_errors = True
+			elif command == "dtc.off":
+				self.update_errors = False
+			elif command == "data.on":
+				self.update_tables = True
+			elif command == "data.off":
+				self.update_tables = False
+
+	def read(self, binfile, offset, passwd):
+		self.submit("read", binfile, offset, passwd)
+
+	def write(self, byts, offset, skipblank=False):
+		self.submit("write", byts, offset, skipblank)
+
+	def erase(self):
+		self.submit("write", None, 0, False)
+
+	def HRCSettingsPanelHandler(self, mode, data, serial=None):
+		if self.routed(serial):
+			self.submit("hrc", mode, data)
+
+	def WritePanelHandler(self, data, offset, skipblank=False, serial=None):
+		if self.routed(serial):
+			self.write(data, offset, skipblank)
+
+	def ReadPanelHandler(self, data, offset, passwd, serial=None):
+		if self.routed(serial):
+			self.read(data, offset, passwd)
+
+	def DatalogPanelHandler(self, action, serial=None):
+		if self.routed(serial) and action in COMMAND_PRIORITY:
+			self.submit(action)
+
+	def ErrorPanelHandler(self, action, serial=None):
+		if self.routed(serial) and action in COMMAND_PRIORITY:
+			self.submit(action)
+
+	def activate(self):
+		try:
+			ecu = HondaECU(self.adapter(device_id=self.serial))
+		except FtdiError:
+			return
+		self.__clear_data()
+		self.ecu = instrument(ecu, self.stats)
+		self.ready = True
 
 	def read_flash(self):
-		readsize = 12
-		location = self.readinfo[1]
-		binfile = self.readinfo[0]
-		status = "bad"
-		with open(binfile, "wb") as fbin:
-			t = time.time()
-			size = location
-			rate = 0
-			while not self.readinfo is None:
-				info = self.ecu.send_command([0x82, 0x82, 0x00], format_read(location) + [readsize])
-				if not info:
-					readsize -= 1
-					if readsize < 1:
-						break
-				else:
-					fbin.write(info[2])
-					fbin.flush()
-					location += readsize
-					n = time.time()
-					wx.CallAfter(dispatcher.send, signal="KlineWorker", sender=self, info="read.progress", value=(-1,"%.02fKB @ %s" % (location/1024.0, "%.02fB/s" % (rate) if rate > 0 else "---")))
-					if n-t > 1:
-						rate = (location-size)/(n-t)
-						t = n
-						size = location
-			if self.ecu.dev.kline():
-				wx.CallAfter(dispatcher.send, signal="KlineWorker", sender=self, info="read.progress", value=(-1,"%.02fKB @ %s" % (location/1024.0, "%.02fB/s" % (rate) if rate > 0 else "---")))
+		sizer = ReadBlockSizer()
+		rbuf = ReadBuffer(self.readinfo[0], self.readinfo[1])
+		if rbuf.resume():
+			self.notify("read.progress", (-1,"resuming at %.02fKB" % (rbuf.location/1024.0)))
+		progress = ProgressReporter(self.notify, "read.transfer", start=rbuf.location)
+		t = time.time()
+		failures = 0
+		while not self.readinfo is None:
+			readsize = sizer.size
+			info = self.ecu.send_command([0x82, 0x82, 0x00], format_read(rbuf.location) + [readsize])
+			if not info:
+				failures += 1
+				if failures >= READ_RETRIES:
+					break
+				sizer.failure()
 			else:
-				return "interrupted"
-		with open(binfile, "rb") as fbin:
-			nbyts = os.path.getsize(binfile)
-			if nbyts > 0:
-				byts = bytearray(fbin.read(nbyts))
-				_, status, _ = do_validation(byts, nbyts)
-			return status
-
-	def write_flash(self, byts, offset=0):
+				failures = 0
+				rbuf.append(info[2])
+				sizer.success()
+				progress.update(rbuf.location, blocksize=readsize)
+				n = time.time()
+				if n-t > 1:
+					t = n
+					rbuf.save()
+		self.notify("read.blocksize", sizer.settled)
+		if self.readinfo is None or not self.ecu.dev.kline() or rbuf.location % READ_ALIGN != 0:
+			# stopped, unplugged or given up mid-image, keep the checkpoint to resume from
+			rbuf.save()
+			return "interrupted"
+		progress.finish()
+		rbuf.commit()
+		return rbuf.status()
+
+	def write_flash(self, byts, offset=0, skipblank=False):
 		ossize = len(byts)
 		offseti = int(offset/16)
-		writesize=128
+		key = ecu_key(self.ecmid)
+		profile = self.profiles.get(key)
+		writesize = profile.get("writesize", 128)
+		clean = profile.get("clean64", 0)
+		if writesize == 64 and clean >= WRITESIZE_RETRY:
+			writesize = 128
+		pacer = WritePacer(delay=profile.get("writedelay", .200))
+		retried = False
+		fallback = False
+		failed = False
 		z = int(writesize/16)
-		maxi = int(ossize/writesize)
-		i = 0
+		blocks = write_plan(byts, writesize, skipblank)
+		maxi = len(blocks)
+		j = 0
 		w = 0
-		t = time.time()
-		rate = 0
-		size = 0
-		while not self.writeinfo is None and i < maxi:
+		progress = ProgressReporter(self.notify, "write.transfer", total=maxi*writesize, position=0, size=ossize, writesize=writesize)
+		while not self.writeinfo is None and j < maxi:
+			i = blocks[j]
 			w = (i*writesize)
 			bytstart = [s for s in struct.pack(">H",offseti+(z*i))]
-			if i+1 == maxi:
+			if j+1 == maxi:
 				bytend = [s for s in struct.pack(">H",0)]
 			else:
-				bytend = [s for s in struct.pack(">H",offseti+(z*(i+1)))]
+				bytend = [s for s in struct.pack(">H",offseti+(z*blocks[j+1]))]
 			d = list(byts[((i+0)*writesize):((i+1)*writesize)])
 			x = bytstart + d + bytend
 			c1 = checksum8bit(x)
@@ -154,104 +244,129 @@ class KlineWorker(Thread):
 			info = self.ecu.send_command([0x7e], x)
 			if info is not None:
 				if ord(info[1]) != 5:
-					wx.CallAfter(dispatcher.send, signal="KlineWorker", sender=self, info="write.progress", value=(0, "interrupted"))
+					self.notify("write.progress", (0, "interrupted"))
 					return 1
 			else:
-				if i == 0:
+				if j == 0:
 					if writesize == 128:
 						writesize = 64
+						fallback = True
 						z = int(writesize/16)
-						maxi = int(ossize/writesize)
+						blocks = write_plan(byts, writesize, skipblank)
+						maxi = len(blocks)
+						progress.total = maxi*writesize
 						continue
 					else:
-						wx.CallAfter(dispatcher.send, signal="KlineWorker", sender=self, info="write.progress", value=(0, "failed"))
+						self.notify("write.progress", (0, "failed"))
 						return 2
+				elif writesize == 64 and not retried:
+					retried = True
+					failed = True
+					pacer.failure()
+					pacer.settle(self.ecu)
+					continue
 				else:
-					wx.CallAfter(dispatcher.send, signal="KlineWorker", sender=self, info="write.progress", value=(0, "interrupted"))
+					self.notify("write.progress", (0, "interrupted"))
 					return 3
-			n = time.time()
-			wx.CallAfter(dispatcher.send, signal="KlineWorker", sender=self, info="write.progress", value=(i/maxi*100,"%.02fKB of %.02fKB @ %s" % (w/1024.0, ossize/1024.0, "%.02fB/s" % (rate) if rate > 0 else "---")))
-			if n-t > 1:
-				rate = (w-size)/(n-t)
-				t = n
-				size = w
-			i += 1
-			if i % 2 == 0:
+			retried = False
+			j += 1
+			progress.update(j*writesize, position=w+writesize, size=ossize, writesize=writesize)
+			if j % 2 == 0:
 				if writesize == 64:
 					self.ecu.send_command([0x7e], [0x01, 0x07])
-					time.sleep(.200)
-		wx.CallAfter(dispatcher.send, signal="KlineWorker", sender=self, info="progress", value=(i/maxi*100,"%.02fKB of %.02fKB @ %s" % ((w-offset)/1024.0, ossize/1024.0, "%.02fB/s" % (rate) if rate > 0 else "---")))
+					pacer.settle(self.ecu)
+		if j < maxi:
+			self.notify("write.progress", (0, "interrupted"))
+			return 4
+		if writesize == 64 and not fallback and not failed:
+			clean += 1
+		else:
+			clean = 0
+		self.profiles.update(key, writesize=writesize, writedelay=round(pacer.delay, 3), clean64=clean)
+		progress.finish()
 		return 0
 
 	def do_init_write(self, recover=False):
 		if recover:
 			self.state = ECUSTATE.INIT_RECOVER
-			wx.CallAfter(dispatcher.send, signal="KlineWorker", sender=self, info="state", value=self.state)
+			self.notify("state", self.state)
 			self.ecu.do_init_recover()
 			self.ecu.send_command([0x72],[0x00, 0xf1])
 			time.sleep(1)
 			self.ecu.send_command([0x27],[0x00, 0x01, 0x00])
 		else:
 			self.state = ECUSTATE.INIT_WRITE
-			wx.CallAfter(dispatcher.send, signal="KlineWorker", sender=self, info="state", value=self.state)
+			self.notify("state", self.state)
 			self.ecu.do_init_write()
 		time.sleep(.100)
 
-	def do_erase(self, wait=11):
+	def do_erase(self):
 		ret = 1
 		self.state = ECUSTATE.ERASING
-		wx.CallAfter(dispatcher.send, signal="KlineWorker", sender=self, info="state", value=self.state)
-		wx.CallAfter(dispatcher.send, signal="KlineWorker", sender=self, info="erase", value=None)
+		self.notify("state", self.state)
+		self.notify("erase", None)
+		key = ecu_key(self.ecmid)
+		timing = EraseTiming(ECM_IDs.get(bytes(self.ecmid), {}), self.profiles.get(key))
 		self.ecu.get_write_status()
-		for i in range(wait):
-			w = wait-i
-			wx.CallAfter(dispatcher.send, signal="KlineWorker", sender=self, info="write.progress", value=(w/wait*100, "waiting for %d seconds" % (w)))
-			time.sleep(1)
-		wx.CallAfter(dispatcher.send, signal="KlineWorker", sender=self, info="write.progress", value=(0, "waiting for %d seconds" % (w)))
+		t = time.time()
+		w = timing.wait
+		while w > 0:
+			if self.writeinfo is None:
+				return ret
+			self.notify("write.progress", (w/timing.wait*100, "waiting for %d seconds" % round(w)))
+			time.sleep(min(1, w))
+			w = timing.wait - (time.time()-t)
+		self.notify("write.progress", (0, "waiting for 0 seconds"))
 		if self.ecu.do_erase():
-			time.sleep(2)
-			e = 0
+			t = time.time()
+			time.sleep(ERASE_SETTLE)
+			misses = 0
 			while True:
-				wx.CallAfter(dispatcher.send, signal="KlineWorker", sender=self, info="write.progress", value=(np.clip(e/35*100,0,100), "erasing ecu"))
-				time.sleep(.1)
-				e += 1
+				e = time.time() - t
+				self.notify("write.progress", (timing.progress(e), "erasing ecu"))
+				time.sleep(timing.interval(e, misses))
 				info = self.ecu.send_command([0x7e], [0x01, 0x05])
 				if info:
+					misses = 0
 					if info[2][1] == 0x00:
+						self.profiles.update(key, erasetime=timing.measured(time.time()-t))
 						self.ecu.get_write_status()
 						ret = 0
 						break
 					elif info[2][1] == 0xfa:
-						wx.CallAfter(dispatcher.send, signal="KlineWorker", sender=self, info="write.progress", value=(0, "erase block error"))
+						self.notify("write.progress", (0, "erase block error"))
 						ret = 2
 						break
-				else:
+				elif timing.expired(time.time() - t):
+					self.notify("write.progress", (0, "erase timed out"))
 					break
+				else:
+					misses += 1
 		else:
-			wx.CallAfter(dispatcher.send, signal="KlineWorker", sender=self, info="write.progress", value=(0, "erase failed"))
+			self.notify("write.progress", (0, "erase failed"))
 		return ret
 
-	def do_write(self):
+	def do_write(self, info):
 		ret = 1
 		self.state = ECUSTATE.WRITING
-		wx.CallAfter(dispatcher.send, signal="KlineWorker", sender=self, info="state", value=self.state)
-		wx.CallAfter(dispatcher.send, signal="KlineWorker", sender=self, info="write", value=None)
-		if self.write_flash(self.writeinfo[0], offset=self.writeinfo[1]) == 0:
-			self.writeinfo[2] = "good" if self.ecu.do_post_write() else "bad"
-			wx.CallAfter(dispatcher.send, signal="KlineWorker", sender=self, info="write.result", value=self.writeinfo[2])
+		self.notify("state", self.state)
+		self.notify("write", None)
+		if self.write_flash(info[0], offset=info[1], skipblank=info[3]) == 0:
+			info[2] = "good" if self.ecu.do_post_write() else "bad"
+			self.notify("write.result", info[2])
 			ret = 0
 		return ret
 
-	def do_read(self):
+	def do_read(self, info):
 		ret = 1
 		self.state = ECUSTATE.READING
-		wx.CallAfter(dispatcher.send, signal="KlineWorker", sender=self, info="state", value=self.state)
-		wx.CallAfter(dispatcher.send, signal="KlineWorker", sender=self, info="read", value=None)
-		self.readinfo[2] = self.read_flash()
-		if self.readinfo[2] == "interrupted":
-			wx.CallAfter(dispatcher.send, signal="KlineWorker", sender=self, info="read.progress", value=(0, "interrupted"))
+		self.notify("state", self.state)
+		self.notify("read", None)
+		info[2] = self.read_flash()
+		if info[2] == "interrupted":
+			self.notify("read.progress", (0, "interrupted"))
 		else:
-			wx.CallAfter(dispatcher.send, signal="KlineWorker", sender=self, info="read.result", value=self.readinfo[2])
+			self.notify("read.result", info[2])
 			ret = 0
 		return ret
 
@@ -260,7 +375,8 @@ class KlineWorker(Thread):
 		info = self.ecu.send_command([0x72], [0x71, 0x00])
 		if info:
 			self.ecmid = info[2][2:7]
-			wx.CallAfter(dispatcher.send, signal="KlineWorker", sender=self, info="ecmid", value=bytes(self.ecmid))
+			self.dtcscanner.interval = self.profiles.get(ecu_key(self.ecmid)).get("dtcinterval", DTC_INTERVAL)
+			self.notify("ecmid", bytes(self.ecmid))
 			ret = 0
 		return ret
 
@@ -269,7 +385,7 @@ class KlineWorker(Thread):
 		info = self.ecu.send_command([0x7d], [0x01, 0x01, 0x03])
 		if info:
 			self.flashcount = int(info[2][4])
-			wx.CallAfter(dispatcher.send, signal="KlineWorker", sender=self, info="flashcount", value=self.flashcount)
+			self.notify("flashcount", self.flashcount)
 			ret = 0
 		return ret
 
@@ -282,54 +398,69 @@ class KlineWorker(Thread):
 					ret = 0
 					self.dtccount = -1
 					self.errorcodes = {}
+					self.dtcscanner.restart()
 					self.clear_codes = False
 			else:
 				self.dtccount = -1
 				self.errorcodes = {}
+				self.dtcscanner.restart()
 				self.clear_codes = False
 		return ret
 
 	def do_get_dtcs(self):
-		errorcodes = {}
-		for type in [0x74,0x73]:
-			errorcodes[hex(type)] = []
-			for i in range(1,0x0c):
-				info = self.ecu.send_command([0x72],[type, i])
-				if info:
-					for j in [3,5,7]:
-						if info[2][j] != 0:
-							errorcodes[hex(type)].append("%02d-%02d" % (info[2][j],info[2][j+1]))
-					if info[2] == 0:
-						return 1
-				else:
-					return 1
+		req = self.dtcscanner.next()
+		if req is None:
+			return 0
+		info = self.ecu.send_command([0x72], list(req))
+		if not info or len(info[2]) < 9:
+			return 1
+		codes = []
+		for j in [3,5,7]:
+			if info[2][j] != 0:
+				codes.append("%02d-%02d" % (info[2][j],info[2][j+1]))
+		errorcodes = self.dtcscanner.result(req, codes)
+		if errorcodes is None:
+			return 0
 		dtccount = sum([len(c) for c in errorcodes.values()])
 		if self.dtccount != dtccount:
 			self.dtccount = dtccount
-			wx.CallAfter(dispatcher.send, signal="KlineWorker", sender=self, info="dtccount", value=self.dtccount)
+			self.notify("dtccount", self.dtccount)
 		if self.errorcodes != errorcodes:
 			self.errorcodes = errorcodes
-			wx.CallAfter(dispatcher.send, signal="KlineWorker", sender=self, info="dtc", value=self.errorcodes)
+			self.notify("dtc", self.errorcodes)
 		return 0
 
 	def do_probe_tables(self):
 		tables = self.ecu.probe_tables()
 		if len(tables) > 0:
 			self.tables = tables
+			rates = self.profiles.get(ecu_key(self.ecmid)).get("tablerates", {})
+			self.scheduler = TableScheduler(self.tables.keys(), dict((int(t,16), tuple(r)) for t, r in rates.items()))
 			tables = " ".join([hex(x) for x in self.tables.keys()])
 			for t, d in self.tables.items():
-				wx.CallAfter(dispatcher.send, signal="KlineWorker", sender=self, info="data", value=(t,d[0],d[1]))
+				self.notify("data", decode_frame(t, d[1][2:]))
 			return 0
 		else:
 			return 1
 
 	def do_update_tables(self):
-		for t in self.tables:
+		end = time.time() + UPDATE_SLICE
+		while self.update_tables and not self.pending():
+			now = time.time()
+			if now >= end:
+				break
+			if self.update_errors and self.do_get_dtcs() > 0:
+				return 1
+			t, wait = self.scheduler.next(now)
+			if t is None:
+				self.wait(min(wait, end - now))
+				continue
 			info = self.ecu.send_command([0x72], [0x71, t])
 			if info:
 				if info[3] > 2:
 					self.tables[t] = [info[3],info[2]]
-					wx.CallAfter(dispatcher.send, signal="KlineWorker", sender=self, info="data", value=(t,info[3],info[2]))
+					self.scheduler.served(t)
+					self.notify("data", decode_frame(t, info[2][2:]))
 				else:
 					return 1
 			else:
@@ -352,11 +483,18 @@ class KlineWorker(Thread):
 			ret += self.do_update_tables()
 		return ret
 
+	def idle(self):
+		if self.state != ECUSTATE.OK or self.writeinfo is not None or self.clear_codes:
+			return False
+		if self.update_tables or self.update_errors:
+			return False
+		return bool(self.ecmid) and self.flashcount >= 0 and self.dtccount >= 0 and bool(self.tables)
+
 	def do_update_state(self):
 		state = self.ecu.detect_ecu_state()
 		if state != self.state:
 			self.state = state
-			wx.CallAfter(dispatcher.send, signal="KlineWorker", sender=self, info="state", value=self.state)
+			self.notify("state", self.state)
 			if self.state == ECUSTATE.OFF:
 				self.reset_state()
 
@@ -364,22 +502,29 @@ class KlineWorker(Thread):
 		p1 = self.ecu.send_command([0x27],[0xe0] + self.readinfo[3][:7])
 		p2 = self.ecu.send_command([0x27],[0xe0] + self.readinfo[3][7:])
 		passok = (p1 != None) and (p2 != None)
-		wx.CallAfter(dispatcher.send, signal="KlineWorker", sender=self, info="password", value=passok)
+		self.notify("password", passok)
 
 	def write_helper(self, init=False, recover=False, nodiag=False):
 		ret = 1
+		info = self.writeinfo
 		if nodiag or self.ecu.diag():
 			if init:
 				self.do_init_write(recover=recover)
 				time.sleep(.100)
 			if self.do_erase() == 0:
-				self.do_write()
+				if info[0] is not None:
+					self.do_write(info)
+				else:
+					info[2] = "erased"
 				ret = 0
+			self.notify("write.done", info[2])
 			self.writeinfo = None
 		return ret
 
 	def read_helper(self):
-		ret = self.do_read()
+		info = self.readinfo
+		ret = self.do_read(info)
+		self.notify("read.done", info[2])
 		self.readinfo = None
 		return ret
 
@@ -415,9 +560,12 @@ class KlineWorker(Thread):
 		return ret
 
 	def run(self):
-		while self.parent.run:
+		while self.parent.run and self.running:
+			self.process_commands()
 			if not self.ready:
-				time.sleep(.001)
+				self.activate()
+				if not self.ready:
+					self.wait(.5)
 			else:
 				try:
 					if self.state in [ECUSTATE.UNDEFINED, ECUSTATE.OFF, ECUSTATE.UNKNOWN]:
@@ -427,10 +575,14 @@ class KlineWorker(Thread):
 						else:
 							self.ecu.init()
 							self.ecu.ping()
+							if self.readinfo is None:
+								self.wait(OFF_WAIT)
 					else:
 						if self.ecu.diag():
 							if self.do_connected() > 0:
 								self.do_update_state()
+							elif self.idle():
+								self.wait(IDLE_WAIT)
 						else:
 							if self.do_exceptions() > 0:
 								self.do_update_state()
@@ -440,3 +592,36 @@ class KlineWorker(Thread):
 					pass
 				except OSError:
 					pass
+		if self.ecu:
+			try:
+				self.ecu.dev.close()
+			except (FtdiError, OSError):
+				pass
+
+class KlineWorkerPool(object):
+
+	def __init__(self, parent, post=None, adapter=KlineAdapter):
+		self.parent = parent
+		self.post = post
+		self.adapter = adapter
+		self.profiles = ECUProfiles()
+		self.workers = {}
+
+	def add(self, serial):
+		if not serial in self.workers:
+			self.workers[serial] = KlineWorker(self.parent, serial, post=self.post, adapter=self.adapter, profiles=self.profiles)
+			self.workers[serial].start()
+
+	def remove(self, serial):
+		if serial in self.workers:
+			self.workers[serial].stop()
+			del self.workers[serial]
+
+	def get(self, serial):
+		return self.workers.get(serial, None)
+
+	def join(self):
+		for w in self.workers.values():
+			w.stop()
+		for w in self.workers.values():
+			w.join()
@@ -0,0 +1,282 @@
+import os
+import json
+import time
+import zlib
+import tarfile
+
+from eculib.honda import do_validation
+
+MAX_READSIZE = 0xf0
+# consecutive failed reads before giving up, the image end is found this way too
+READ_RETRIES = 12
+# flash images end on this boundary, a read giving up elsewhere stopped mid-image
+READ_ALIGN = 0x1000
+ERASE_WAIT = 11
+ERASE_TIME = 6.0
+ERASE_SETTLE = 2.0
+ERASE_DEADLINE = 3
+PROGRESS_INTERVAL = .1
+DEFAULT_PASSWORD = [0x48, 0x65, 0x6c, 0x6c, 0x6f, 0x48, 0x6f, 0x77, 0x41, 0x72, 0x65, 0x59, 0x6f, 0x75]
+
+class ReadBlockSizer(object):
+
+	def __init__(self, size=12, maxsize=MAX_READSIZE, grow=8, reprobe=64):
+		self.size = size
+		self.grow = grow
+		self.reprobe = reprobe
+		self.good = 0
+		self.maxsize = maxsize
+		self.ceiling = maxsize
+		self.clean = 0
+		self.run = 0
+		self.counts = {}
+
+	def success(self):
+		self.counts[self.size] = self.counts.get(self.size, 0) + 1
+		if self.size > self.good:
+			self.good = self.size
+		self.clean += 1
+		self.run += 1
+		if self.clean >= self.grow:
+			self.clean = 0
+			if self.size < self.good:
+				# recovering from a back off, return quickly to the last size that worked
+				self.size = min(self.size*2, self.good)
+			elif self.size < self.ceiling:
+				# probing for a bigger block than the ecu has accepted so far
+				self.size += 1
+			elif self.ceiling < self.maxsize and self.run >= self.reprobe:
+				# a long clean run lifts the cap a failed probe left behind
+				self.ceiling = self.maxsize
+
+	def failure(self):
+		self.clean = 0
+		self.run = 0
+		if self.good > 0 and self.size > self.good:
+			self.ceiling = self.good
+			self.size = self.good
+		else:
+			self.size = max(1, self.size // 2)
+
+	@property
+	def settled(self):
+		if len(self.counts) > 0:
+			return max(self.counts, key=self.counts.get)
+		return self.size
+
+class ReadCheckpoint(object):
+
+	def __init__(self, binfile):
+		self.path = binfile + ".ckpt"
+		self.partfile = binfile + ".part"
+
+	def load(self, start):
+		if not os.path.isfile(self.path) or not os.path.isfile(self.partfile):
+			return None
+		try:
+			with open(self.path, "r") as f:
+				info = json.load(f)
+			if info["start"] != start:
+				return None
+			nbyts = info["location"] - start
+			with open(self.partfile, "rb") as fpart:
+				byts = fpart.read(nbyts)
+		except (IOError, ValueError, KeyError, TypeError):
+			return None
+		if len(byts) != nbyts or zlib.crc32(byts) != info["crc32"]:
+			return None
+		return byts
+
+	def save(self, start, location, crc):
+		tmp = self.path + ".tmp"
+		with open(tmp, "w") as f:
+			json.dump({"start":start, "location":location, "crc32":crc}, f)
+		os.replace(tmp, self.path)
+
+	def clear(self):
+		for f in [self.path, self.partfile]:
+			if os.path.isfile(f):
+				os.remove(f)
+
+class ReadBuffer(object):
+
+	def __init__(self, binfile, start, size=0x40000):
+		self.binfile = binfile
+		self.start = start
+		self.checkpoint = ReadCheckpoint(binfile)
+		self.buf = bytearray(size)
+		self.length = 0
+		self.flushed = 0
+		self.crc = 0
+		self.sum = 0
+		self.complete = True
+
+	@property
+	def location(self):
+		return self.start + self.length
+
+	def resume(self):
+		byts = self.checkpoint.load(self.start)
+		if not byts:
+			# a stale part file must not be appended to
+			self.checkpoint.clear()
+			return False
+		with open(self.checkpoint.partfile, "r+b") as fpart:
+			fpart.truncate(len(byts))
+		self.append(byts)
+		self.flushed = self.length
+		return True
+
+	def append(self, data):
+		n = len(data)
+		while self.length + n > len(self.buf):
+			self.buf.extend(bytearray(len(self.buf)))
+		self.buf[self.length:(self.length+n)] = data
+		self.length += n
+		self.crc = zlib.crc32(data, self.crc)
+		self.sum += sum(data)
+
+	def save(self, sync=False):
+		with open(self.checkpoint.partfile, "ab") as fpart:
+			fpart.write(self.buf[self.flushed:self.length])
+			fpart.flush()
+			if sync:
+				os.fsync(fpart.fileno())
+		self.flushed = self.length
+		self.checkpoint.save(self.start, self.location, self.crc)
+
+	def commit(self):
+		self.save(sync=True)
+		if os.path.getsize(self.checkpoint.partfile) != self.length:
+			self.complete = False
+			self.checkpoint.clear()
+			return False
+		os.replace(self.checkpoint.partfile, self.binfile)
+		self.checkpoint.clear()
+		return True
+
+	def status(self):
+		# the honda checksum byte makes the whole image sum to zero
+		if self.complete and self.length > 0 and self.sum & 0xFF == 0:
+			return "good"
+		return "bad"
+
+def write_plan(byts, writesize, skipblank=False):
+	maxi = int(len(byts)/writesize)
+	if not skipblank:
+		return list(range(maxi))
+	blank = b"\xff" * writesize
+	# the first and last blocks are always sent, they open and terminate the chain
+	return [i for i in range(maxi) if i == 0 or i == maxi-1 or byts[(i*writesize):((i+1)*writesize)] != blank]
+
+class WritePacer(object):
+
+	def __init__(self, delay=.200, mindelay=.020, maxwait=1.0):
+		self.delay = delay
+		self.floor = mindelay
+		self.maxwait = maxwait
+
+	def settle(self, ecu):
+		# wait the learned time after a 0x7e 0x01 0x07, then poll until the ecu answers again
+		t = time.time()
+		time.sleep(self.delay)
+		polls = 0
+		while ecu.get_write_status() is None:
+			polls += 1
+			if time.time() - t > self.maxwait:
+				break
+		if polls == 0:
+			self.delay = max(self.floor, self.delay*.9)
+		else:
+			self.delay = min(self.maxwait, time.time() - t)
+
+	def failure(self):
+		self.floor = min(self.maxwait, self.delay*1.5)
+		self.delay = self.floor
+
+class EraseTiming(object):
+
+	def __init__(self, ecminfo, profile):
+		self.wait = float(ecminfo.get("erasewait", ERASE_WAIT))
+		self.duration = float(profile.get("erasetime", ecminfo.get("erasetime", ERASE_TIME)))
+		self.previous = profile.get("erasetime", None)
+
+	def interval(self, elapsed, misses=0):
+		# poll sparsely at first and tighten up as the expected completion approaches,
+		# backing off again while the ecu is too busy to answer
+		return min(1.0, max(.1, (self.duration-elapsed)/4) * 2**misses)
+
+	def expired(self, elapsed):
+		return elapsed > max(self.duration*ERASE_DEADLINE, ERASE_SETTLE+ERASE_TIME)
+
+	def progress(self, elapsed):
+		return min(elapsed/self.duration*100, 99)
+
+	def measured(self, elapsed):
+		if self.previous is None:
+			return round(elapsed, 2)
+		return round((self.previous+elapsed)/2, 2)
+
+class ProgressReporter(object):
+
+	def __init__(self, notify, info, total=None, start=0, interval=PROGRESS_INTERVAL, **extra):
+		self.notify = notify
+		self.info = info
+		self.total = total
+		self.interval = interval
+		self.done = start
+		self.extra = extra
+		self.rate = 0
+		self.start = time.time()
+		self.last = 0
+		self.window = (self.start, start)
+
+	def update(self, done, force=False, **extra):
+		self.done = done
+		self.extra.update(extra)
+		now = time.time()
+		if now - self.window[0] >= 1:
+			self.rate = (done - self.window[1]) / (now - self.window[0])
+			self.window = (now, done)
+		if force or now - self.last >= self.interval:
+			self.last = now
+			value = {"done":self.done, "total":self.total, "rate":self.rate, "elapsed":now - self.start}
+			value.update(self.extra)
+			self.notify(self.info, value)
+
+	def finish(self):
+		self.update(self.done, force=True)
+
+def load_bin(path, checksum=-1):
+	with open(path, "rb") as fbin:
+		byts = bytearray(fbin.read())
+	if checksum >= len(byts):
+		return "bad", None
+	ret, status, byts = do_validation(byts, len(byts), checksum)
+	return status, byts
+
+def load_htf(path):
+	tar = tarfile.open(path, "r:xz")
+	binmod = None
+	metainfo = None
+	for f in tar.getnames():
+		if f == "metainfo.json":
+			metainfo = json.load(tar.extractfile(f))
+		else:
+			b,e = os.path.splitext(f)
+			if e == ".bin":
+				x, y = os.path.splitext(b)
+				if y == ".mod":
+					binmod = bytearray(tar.extractfile(f).read())
+	if binmod == None or metainfo == None:
+		return "bad", None, None
+	ea = int(metainfo["ecmidaddr"],16)
+	ka = int(metainfo["keihinaddr"],16)
+	offset = metainfo["offset"] if "offset" in metainfo else None
+	if "rid" in metainfo and metainfo["rid"] != None:
+		for i in range(5):
+			binmod[ea+i] ^= 0xFF
+		for i in range(7):
+			binmod[ka+i] = ord(metainfo["rid"][i])
+	ret, status, byts = do_validation(binmod, len(binmod), int(metainfo["checksum"],16))
+	return status, byts, offset
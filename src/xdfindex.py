@@ -0,0 +1,108 @@
+import io
+import os
+import json
+import hashlib
+from lxml import etree
+
+XDFINDEX_VERSION = 1
+
+def children(e):
+	d = {}
+	for c in e:
+		if not c.tag in d:
+			d[c.tag] = c
+	return d
+
+def text(d, tag):
+	if tag in d:
+		return d[tag].text
+	return None
+
+def axis_info(a):
+	d = children(a)
+	t = None
+	linkobjid = None
+	if "embedinfo" in d:
+		t = int(d["embedinfo"].get("type"))
+		linkobjid = d["embedinfo"].get("linkobjid")
+	return int(d["indexcount"].text), t, linkobjid, text(d, "outputtype"), text(d, "decimalpl")
+
+def table_info(t):
+	d = children(t)
+	axes = {}
+	for a in t:
+		if a.tag == "XDFAXIS" and not a.get("id") in axes:
+			axes[a.get("id")] = a
+	categories = [None, None, None]
+	for c in t:
+		if c.tag == "CATEGORYMEM" and c.get("index") in ("0", "1", "2"):
+			i = int(c.get("index"))
+			if categories[i] is None:
+				categories[i] = c.get("category")
+	xindexcount, xtype, xlinkobjid, xot, xdp = axis_info(axes["x"])
+	yindexcount, ytype, ylinkobjid, yot, ydp = axis_info(axes["y"])
+	z = children(axes["z"])
+	eq = None
+	if "MATH" in z:
+		eq = z["MATH"].get("equation")
+	e = z["EMBEDDEDDATA"]
+	ff = e.get("mmedtypeflags")
+	ff = int(ff,16) if ff != None else 0
+	return {
+		"uid": t.get("uniqueid"),
+		"flags": int(t.get("flags"),16),
+		"title": d["title"].text,
+		"address": int(e.get("mmedaddress"),16),
+		"stride": int(e.get("mmedelementsizebits")),
+		"categories": categories,
+		"axisinfo": {
+			'x': {'indexcount': xindexcount, 'type': xtype, 'linkobjid': xlinkobjid, 'xot': xot, 'xdp': xdp},
+			'y': {'indexcount': yindexcount, 'type': ytype, 'linkobjid': ylinkobjid, 'yot': yot, 'ydp': ydp},
+			'z': {'eq':eq, 'zot': text(z, "outputtype"), 'zdp': text(z, "decimalpl"), 'zmin': text(z, "min"), 'zmax': text(z, "max"), 'lsb': "<" if (ff & 0x02) else ">"}
+		}
+	}
+
+def index_xdf(xdf):
+	categories = {}
+	tables = []
+	for event, e in etree.iterparse(io.BytesIO(xdf), events=("end",), tag=("CATEGORY", "XDFTABLE")):
+		p = e.getparent()
+		if e.tag == "CATEGORY":
+			if p is not None and p.tag == "XDFHEADER":
+				categories[e.get("index")] = e.get("name")
+			continue
+		if p is None or p.getparent() is not None:
+			continue
+		tables.append(table_info(e))
+		e.clear()
+		while e.getprevious() is not None:
+			del p[0]
+	return {"version": XDFINDEX_VERSION, "categories": categories, "tables": tables}
+
+class XDFIndexCache(object):
+
+	def __init__(self, path=None):
+		if path is None:
+			path = os.path.join(os.path.expanduser("~"), ".hondaecu", "xdfcache")
+		self.path = path
+
+	def load(self, xdf):
+		f = os.path.join(self.path, hashlib.sha1(xdf).hexdigest() + ".json")
+		try:
+			with open(f, "r") as fp:
+				index = json.load(fp)
+			if index.get("version") == XDFINDEX_VERSION:
+				return index
+		except (IOError, ValueError):
+			pass
+		index = index_xdf(xdf)
+		try:
+			if not os.path.isdir(self.path):
+				os.makedirs(self.path)
+			tmp = f + ".tmp"
+			with open(tmp, "w") as fp:
+				json.dump(index, fp)
+			os.replace(tmp, f)
+		except (IOError, OSError):
+			pass
+		return index
@@ -0,0 +1,260 @@
+import math
+import operator
+import numpy as np
+from pyparsing import (Literal, CaselessLiteral, Word, Combine, Group, Optional,
+					   ZeroOrMore, Forward, nums, alphas, oneOf)
+
+class NumericStringParser(object):
+	'''
+	Most of this code comes from the fourFn.py pyparsing example
+
+	'''
+
+	def pushFirst(self, strg, loc, toks):
+		self.exprStack.append(toks[0])
+
+	def pushUMinus(self, strg, loc, toks):
+		if toks and toks[0] == '-':
+			self.exprStack.append('unary -')
+
+	def __init__(self):
+		"""
+		expop   :: '^'
+		multop  :: '*' | '/'
+		addop   :: '+' | '-'
+		integer :: ['+' | '-'] '0'..'9'+
+		atom    :: PI | E | real | fn '(' expr ')' | '(' expr ')'
+		factor  :: atom [ expop factor ]*
+		term    :: factor [ multop factor ]*
+		expr    :: term [ addop term ]*
+		"""
+		point = Literal(".")
+		e = CaselessLiteral("E")
+		fnumber = Combine(Word("+-" + nums, nums) +
+						  Optional(point + Optional(Word(nums))) +
+						  Optional(e + Word("+-" + nums, nums)))
+		ident = Word(alphas, alphas + nums + "_$")
+		plus = Literal("+")
+		minus = Literal("-")
+		mult = Literal("*")
+		div = Literal("/")
+		lpar = Literal("(").suppress()
+		rpar = Literal(")").suppress()
+		addop = plus | minus
+		multop = mult | div
+		expop = Literal("^")
+		pi = CaselessLiteral("PI")
+		expr = Forward()
+		atom = ((Optional(oneOf("- +")) +
+				 (ident + lpar + expr + rpar | pi | e | fnumber | ident).setParseAction(self.pushFirst))
+				| Optional(oneOf("- +")) + Group(lpar + expr + rpar)
+				).setParseAction(self.pushUMinus)
+		# by defining exponentiation as "atom [ ^ factor ]..." instead of
+		# "atom [ ^ atom ]...", we get right-to-left exponents, instead of left-to-right
+		# that is, 2^3^2 = 2^(3^2), not (2^3)^2.
+		factor = Forward()
+		factor << atom + \
+			ZeroOrMore((expop + factor).setParseAction(self.pushFirst))
+		term = factor + \
+			ZeroOrMore((multop + factor).setParseAction(self.pushFirst))
+		expr << term + \
+			ZeroOrMore((addop + term).setParseAction(self.pushFirst))
+		# addop_term = ( addop + term ).setParseAction( self.pushFirst )
+		# general_term = term + ZeroOrMore( addop_term ) | OneOrMore( addop_term)
+		# expr <<  general_term
+		self.bnf = expr
+		# map operator symbols to corresponding arithmetic operations
+		epsilon = 1e-12
+		self.opn = {"+": operator.add,
+					"-": operator.sub,
+					"*": operator.mul,
+					"/": operator.truediv,
+					"^": operator.pow}
+		self.fn = {"sin": math.sin,
+				   "cos": math.cos,
+				   "tan": math.tan,
+				   "exp": math.exp,
+				   "abs": abs,
+				   "trunc": lambda a: int(a),
+				   "round": round,
+				   "sgn": lambda a: abs(a) > epsilon and cmp(a, 0) or 0}
+		self.vfn = {"sin": np.sin,
+					"cos": np.cos,
+					"tan": np.tan,
+					"exp": np.exp,
+					"abs": np.abs,
+					"trunc": np.trunc,
+					"round": np.round,
+					"sgn": np.sign}
+		# only functions with a single valued inverse, periodic ones go numeric
+		self.ifn = {"exp": np.log}
+
+	def evaluateStack(self, s):
+		op = s.pop()
+		if op == 'unary -':
+			return -self.evaluateStack(s)
+		if op in "+-*/^":
+			op2 = self.evaluateStack(s)
+			op1 = self.evaluateStack(s)
+			return self.opn[op](op1, op2)
+		elif op == "PI":
+			return math.pi  # 3.1415926535
+		elif op == "E":
+			return math.e  # 2.718281828
+		elif op in self.fn:
+			return self.fn[op](self.evaluateStack(s))
+		elif op[0].isalpha():
+			return 0
+		else:
+			return float(op)
+
+	def eval(self, num_string, parseAll=True):
+		self.exprStack = []
+		results = self.bnf.parseString(num_string, parseAll)
+		val = self.evaluateStack(self.exprStack[:])
+		return val
+
+	def buildTree(self, s, var):
+		op = s.pop()
+		if op == 'unary -':
+			return (op, self.buildTree(s, var))
+		if op in "+-*/^":
+			b = self.buildTree(s, var)
+			a = self.buildTree(s, var)
+			return (op, a, b)
+		elif op in self.vfn:
+			return (op, self.buildTree(s, var))
+		elif op == var:
+			return (var,)
+		return ('const', self.evaluateStack([op]))
+
+	def parseTree(self, num_string, var="X"):
+		self.exprStack = []
+		self.bnf.parseString(num_string, True)
+		return self.buildTree(self.exprStack[:], var)
+
+	def countVar(self, node, var):
+		if node[0] == var:
+			return 1
+		elif node[0] == 'const':
+			return 0
+		return sum([self.countVar(n, var) for n in node[1:]])
+
+	def compileTree(self, node, var):
+		op = node[0]
+		if op == 'const':
+			c = node[1]
+			return lambda x: c
+		elif op == var:
+			return lambda x: x
+		elif op == 'unary -':
+			f = self.compileTree(node[1], var)
+			return lambda x: -f(x)
+		elif op in self.opn:
+			f1 = self.compileTree(node[1], var)
+			f2 = self.compileTree(node[2], var)
+			fn = self.opn[op]
+			return lambda x: fn(f1(x), f2(x))
+		f = self.compileTree(node[1], var)
+		fn = self.vfn[op]
+		return lambda x: fn(f(x))
+
+	def invertTree(self, node, var):
+		# peel operators off the path to the single occurrence of var, outermost first
+		steps = []
+		while node[0] != var:
+			op = node[0]
+			if op == 'unary -':
+				steps.append(np.negative)
+				node = node[1]
+			elif op in self.opn:
+				left = self.countVar(node[1], var) > 0
+				k = self.compileTree(node[2] if left else node[1], var)(0.0)
+				if op == "+":
+					steps.append(lambda y, k=k: y - k)
+				elif op == "-":
+					steps.append((lambda y, k=k: y + k) if left else (lambda y, k=k: k - y))
+				elif op == "*":
+					steps.append(lambda y, k=k: y / k)
+				elif op == "/":
+					steps.append((lambda y, k=k: y * k) if left else (lambda y, k=k: k / y))
+				elif left:
+					steps.append(lambda y, k=k: y ** (1.0 / k))
+				else:
+					steps.append(lambda y, k=k: np.log(y) / np.log(k))
+				node = node[1] if left else node[2]
+			elif op in self.ifn:
+				steps.append(self.ifn[op])
+				node = node[1]
+			else:
+				return None
+		def f(y):
+			for step in steps:
+				y = step(y)
+			return y
+		return f
+
+	def compile(self, num_string, var="X"):
+		f = self.compileTree(self.parseTree(num_string, var), var)
+		def evaluate(x):
+			x = np.asarray(x, dtype=np.float64)
+			with np.errstate(all="ignore"):
+				return np.array(np.broadcast_to(f(x), x.shape), dtype=np.float64)
+		return evaluate
+
+	def compileInverse(self, num_string, var="X"):
+		tree = self.parseTree(num_string, var)
+		if self.countVar(tree, var) != 1:
+			return None
+		f = self.invertTree(tree, var)
+		if f is None:
+			return None
+		def evaluate(y):
+			y = np.asarray(y, dtype=np.float64)
+			with np.errstate(all="ignore"):
+				return np.array(np.broadcast_to(f(y), y.shape), dtype=np.float64)
+		return evaluate
+nsp = NumericStringParser()
+
+EQUATIONS = {}
+
+def compile_equation(eq):
+	if not eq in EQUATIONS:
+		EQUATIONS[eq] = nsp.compile(eq)
+	return EQUATIONS[eq]
+
+INVERSES = {}
+
+def numeric_inverse(f, lo, hi):
+	raw = np.arange(lo, hi+1, dtype=np.float64)
+	values = f(raw)
+	ok = np.isfinite(values)
+	order = np.argsort(values[ok], kind="stable")
+	raw = raw[ok][order]
+	values = values[ok][order]
+	def evaluate(y):
+		y = np.asarray(y, dtype=np.float64)
+		if len(values) < 2:
+			return np.full(y.shape, raw[0] if len(raw) else lo, dtype=np.float64)
+		i = np.clip(np.searchsorted(values, y), 1, len(values)-1)
+		below = y - values[i-1] <= values[i] - y
+		return np.where(below, raw[i-1], raw[i])
+	return evaluate
+
+def inverse_equation(eq, lo, hi):
+	key = (eq, lo, hi)
+	if not key in INVERSES:
+		numeric = numeric_inverse(compile_equation(eq), lo, hi)
+		inverse = nsp.compileInverse(eq)
+		if inverse is None:
+			INVERSES[key] = numeric
+		else:
+			def evaluate(y, inverse=inverse, numeric=numeric):
+				y = np.asarray(y, dtype=np.float64)
+				x = inverse(y)
+				bad = ~np.isfinite(x)
+				if bad.any():
+					x[bad] = numeric(y[bad])
+				return x
+			INVERSES[key] = evaluate
+	return INVERSES[key]